@@ -1,9 +1,10 @@
 #!/usr/bin/env -S uv run --script
 # /// script
-# requires-python = ">=3.8"
+# requires-python = ">=3.10"
 # dependencies = [
 #     "odfpy",
 #     "anthropic",
+#     "tenacity",
 # ]
 # ///
 """
@@ -14,28 +15,94 @@ for each test, and uses Claude (Anthropic API) to generate medical assessments.
 """
 
 import argparse
+import asyncio
+import atexit
+import contextlib
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import logging.handlers
 import os
 import pathlib
+import queue
 import re
+import shelve
 import sys
 import textwrap
+from collections.abc import Iterator, MutableMapping
 from datetime import datetime
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-import anthropic
+from tenacity import (
+    RetryCallState,
+    before_sleep_log,
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
 
 try:
     from odf import teletype, text
-    from odf.opendocument import load
-    from odf.table import Table, TableRow, TableCell
+    from odf.element import Element
+    from odf.namespaces import TABLENS
+    from odf.opendocument import OpenDocument, load
+    from odf.table import Table, TableCell
 except ModuleNotFoundError as exc:
     raise ModuleNotFoundError(
         "The 'odfpy' package is required to read OpenDocument files. "
         "Install it with 'pip install odfpy'."
     ) from exc
 
+if TYPE_CHECKING:
+    import anthropic
+
 
 DEFAULT_ANTHROPIC_MODEL = "claude-sonnet-4-5"
+DEFAULT_CONCURRENCY = 8
+MAX_REQUEST_ATTEMPTS = 6
+ASSESSMENT_MAX_TOKENS = 2048
+# The most output tokens each model allows in a single response, by model ID
+# prefix, with more specific prefixes first.
+_MODEL_MAX_OUTPUT_TOKENS = (
+    ("claude-opus-4-5", 64000),
+    ("claude-opus-4", 32000),
+    ("claude-sonnet-4", 64000),
+    ("claude-haiku-4", 64000),
+    ("claude-3-7-sonnet", 64000),
+    ("claude-3-5-", 8192),
+    ("claude-3-", 4096),
+)
+# Used for models that aren't listed above.
+FALLBACK_MAX_OUTPUT_TOKENS = 8192
+ASSESSMENT_CACHE_PATH = pathlib.Path("~/.cache/bt-viewer/assessments.db")
+# Runs of more repeated cells than this are the empty padding spreadsheets add up
+# to the sheet's full width, rather than data.
+REPEAT_LIMIT = 100
+# Used instead of asking Claude when nothing was out of range recently.
+IN_RANGE_ASSESSMENT = (
+    "All biomarkers within reference ranges on this date; no trends of concern."
+)
+# Rows can be grouped inside tables in these elements, which can be nested.
+_ROW_GROUP_NAMES = frozenset({"table-header-rows", "table-rows", "table-row-group"})
+
+logger = logging.getLogger("assessment")
+
+# Matches "Name {unit} [range]", where both the unit and the range are optional.
+_HEADER_RE = re.compile(
+    r"^(?P<name>.+?)\s*(?:\{(?P<unit>[^}]*)\})?\s*(?:\[(?P<range>[^\]]*)\])?\s*$"
+)
+_NUMBER_PATTERN = r"[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?"
+_NUMBER_RE = re.compile(_NUMBER_PATTERN)
+_BATCH_ASSESSMENT_RE = re.compile(
+    r'<<<ASSESSMENT id="(?P<id>\d+)">>>(?P<assessment>.*?)<<</ASSESSMENT>>>', re.DOTALL
+)
+# Matches "low-high", where either bound may be missing (and may be negative).
+_RANGE_RE = re.compile(
+    rf"^\s*(?P<low>{_NUMBER_PATTERN})?\s*-\s*(?P<high>{_NUMBER_PATTERN})?\s*$"
+)
 
 
 def parse_biomarker_header(header: str) -> dict[str, Any]:
@@ -45,75 +112,102 @@ def parse_biomarker_header(header: str) -> dict[str, Any]:
     Unit is optional (returns None if not present).
     Range is optional (returns None for both if not present).
     """
-    # Pattern to match: Name {unit} [range] where unit and range are optional.
-    # First try with both unit and range.
-    pattern_full = r"^(.+?)\s*\{([^}]*)\}\s*\[([^\]]*)\]$"
-    match = re.match(pattern_full, header.strip())
-
-    if match:
-        name = match.group(1).strip()
-        unit = match.group(2).strip() if match.group(2) else None
-        range_str = match.group(3).strip()
-    else:
-        # Try with just unit, no range.
-        pattern_unit = r"^(.+?)\s*\{([^}]*)\}$"
-        match = re.match(pattern_unit, header.strip())
-
-        if match:
-            name = match.group(1).strip()
-            unit = match.group(2).strip() if match.group(2) else None
-            range_str = ""
-        else:
-            # Try with just range, no unit.
-            pattern_range = r"^(.+?)\s*\[([^\]]*)\]$"
-            match = re.match(pattern_range, header.strip())
-
-            if match:
-                name = match.group(1).strip()
-                unit = None
-                range_str = match.group(2).strip()
-            else:
-                # No unit or range, just the name.
-                name = header.strip()
-                unit = None
-                range_str = ""
+    # Both the unit and the range are optional, so only an empty header won't match.
+    match = _HEADER_RE.match(header.strip())
+    if match is None:
+        return {"name": "", "unit": None, "low": None, "high": None}
+
+    name = match["name"].strip()
+    unit = (match["unit"] or "").strip() or None
+    range_str = (match["range"] or "").strip()
 
     # Parse the range.
     low = None
     high = None
-    if range_str:
-        if "-" in range_str:
-            parts = range_str.split("-", 1)
-            if parts[0].strip():
-                try:
-                    low = float(parts[0].strip())
-                except ValueError:
-                    pass
-            if parts[1].strip():
-                try:
-                    high = float(parts[1].strip())
-                except ValueError:
-                    pass
-        else:
-            # Single value could be either low or high, we'll treat as high for now.
-            try:
-                high = float(range_str.strip())
-            except ValueError:
-                pass
+    range_match = _RANGE_RE.match(range_str)
+    if range_match:
+        if range_match["low"]:
+            low = float(range_match["low"])
+        if range_match["high"]:
+            high = float(range_match["high"])
+    elif _NUMBER_RE.fullmatch(range_str):
+        # Single value could be either low or high, we'll treat as high for now.
+        high = float(range_str)
 
     return {"name": name, "unit": unit, "low": low, "high": high}
 
 
+def _maybe_float(value_str: str) -> float | str | None:
+    """Convert a cell's text to a float if it looks like a number.
+
+    Args:
+        value_str: The text of the cell
+
+    Returns:
+        None for empty text, a float for numeric text, and the stripped text
+        otherwise.
+    """
+    value_str = value_str.strip()
+    if not value_str:
+        return None
+    # Check the shape first, as raising ValueError for every text cell is slow.
+    if _NUMBER_RE.fullmatch(value_str):
+        return float(value_str)
+    return value_str
+
+
+def _iter_table_rows(element: Element) -> Iterator[Element]:
+    """Yield the rows of a table in order, without walking into the cells.
+
+    odfpy's getElementsByType visits every descendant of the table, down to the
+    text of each cell, to find the rows.
+    """
+    for child in element.childNodes:
+        qname = getattr(child, "qname", None)
+        if qname == (TABLENS, "table-row"):
+            yield child
+        elif qname is not None and qname[0] == TABLENS and qname[1] in _ROW_GROUP_NAMES:
+            yield from _iter_table_rows(child)
+
+
+def _iter_row_cells(table: Table) -> Iterator[list[str]]:
+    """Yield the text of every cell in each row of the table, in a single pass.
+
+    Repeated columns are expanded, stopping at the first run of more than
+    REPEAT_LIMIT repeated cells.
+    """
+    for row in _iter_table_rows(table):
+        cells: list[str] = []
+        for cell in row.childNodes:
+            raw_repeat = cell.getAttribute("numbercolumnsrepeated")
+            repeat = int(raw_repeat) if raw_repeat else 1
+            # Stop at large repeated empty columns to avoid excessive processing.
+            if repeat > REPEAT_LIMIT:
+                break
+            # Empty cells have no children, so skip walking them for text.
+            if not cell.childNodes:
+                text_content = ""
+            else:
+                text_content = teletype.extractText(cell).strip()
+            cells.extend(itertools.repeat(text_content, repeat))
+        yield cells
+
+
 def read_ods_tests(
     ods_path: pathlib.Path,
-) -> tuple[list[dict[str, Any]], list[dict[str, Any]], int]:
+) -> tuple[list[dict[str, Any]], list[dict[str, Any]], int, OpenDocument, Table]:
     """Read blood test data from ODS file.
 
     Returns:
-        Tuple of (tests, biomarker_info, assessment_column_index) where:
-        - tests: List of test dictionaries with date, lab, biomarkers, assessment
+        Tuple of (tests, biomarker_info, assessment_column_index, document, table)
+        where:
+        - tests: List of test dictionaries with date, lab, biomarkers, assessment,
+          plus a biomarker_by_name index and the set of out_of_range_names
         - biomarker_info: List of biomarker metadata dicts with name, unit, low, high
         - assessment_column_index: Column index for the Assessment column
+        - document: The loaded document, to write assessments back without
+          parsing the file again
+        - table: The document's first table, which the tests were read from
     """
     ods_path = ods_path.expanduser().resolve()
     if not ods_path.is_file():
@@ -124,30 +218,25 @@ def read_ods_tests(
     except Exception as exc:
         raise ValueError("Invalid OpenDocument file") from exc
 
+    # Tables are children of the spreadsheet, so there's no need to search the
+    # whole document for the first one.
+    spreadsheet = getattr(document, "spreadsheet", None)
     table: Table | None = None
-    for element in document.getElementsByType(Table):
-        table = element
-        break
+    if spreadsheet is not None:
+        for element in spreadsheet.childNodes:
+            if getattr(element, "qname", None) == (TABLENS, "table"):
+                table = element
+                break
 
     if table is None:
         raise ValueError("No table found in ODS file")
 
-    rows = table.getElementsByType(TableRow)
-    if len(rows) < 2:
+    rows = _iter_row_cells(table)
+    headers = next(rows, None)
+    first_data_row = next(rows, None)
+    if headers is None or first_data_row is None:
         raise ValueError("ODS file must have at least a header row and one data row")
 
-    # Parse header row to get column names.
-    header_row = rows[0]
-    headers = []
-    for cell in header_row.childNodes:
-        repeat = int(cell.getAttribute("numbercolumnsrepeated") or "1")
-        text_content = teletype.extractText(cell).strip()
-        # Stop at large repeated empty columns to avoid excessive processing.
-        if repeat > 100:
-            break
-        for _ in range(repeat):
-            headers.append(text_content)
-
     # Find Date, Lab, and Assessment columns.
     date_column_index = None
     lab_column_index = None
@@ -188,17 +277,7 @@ def read_ods_tests(
 
     # Read test data rows.
     tests = []
-    for row_index in range(1, len(rows)):
-        row = rows[row_index]
-        cells = []
-        for cell in row.childNodes:
-            repeat = int(cell.getAttribute("numbercolumnsrepeated") or "1")
-            text_content = teletype.extractText(cell).strip()
-            if repeat > 100:
-                break
-            for _ in range(repeat):
-                cells.append(text_content)
-
+    for row_index, cells in enumerate(itertools.chain([first_data_row], rows), start=1):
         # Skip rows without a date.
         if date_column_index >= len(cells) or not cells[date_column_index]:
             continue
@@ -211,22 +290,23 @@ def read_ods_tests(
             else ""
         )
 
-        # Extract biomarker values for this test.
+        # Extract biomarker values for this test, noting out-of-range ones as we go.
         biomarkers = []
+        out_of_range_names = set()
         for bio_info in biomarker_info:
             idx = bio_info["column_index"]
             value_str = cells[idx] if idx < len(cells) else ""
 
-            # Skip empty values.
-            if not value_str or value_str == ".":
+            # Skip empty values, keeping non-numeric ones as strings.
+            value = _maybe_float(value_str)
+            if value is None or value == ".":
                 continue
 
-            # Try to convert to float.
-            try:
-                value: float | str = float(value_str)
-            except ValueError:
-                # Keep as string if conversion fails.
-                value = value_str
+            # Only numeric values can be out of range.
+            if isinstance(value, float) and is_value_out_of_range(
+                value, bio_info["low"], bio_info["high"]
+            ):
+                out_of_range_names.add(bio_info["name"])
 
             biomarkers.append(
                 {
@@ -244,11 +324,15 @@ def read_ods_tests(
                 "date": date,
                 "lab": lab,
                 "biomarkers": biomarkers,
+                # Index biomarkers by name for history lookups. Iterate in reverse so
+                # the first occurrence wins if a name appears in several columns.
+                "biomarker_by_name": {b["name"]: b for b in reversed(biomarkers)},
+                "out_of_range_names": frozenset(out_of_range_names),
                 "assessment": assessment,
             }
         )
 
-    return tests, biomarker_info, assessment_column_index
+    return tests, biomarker_info, assessment_column_index, document, table
 
 
 def is_value_out_of_range(
@@ -298,27 +382,10 @@ def identify_important_biomarkers(
     Returns:
         Set of biomarker names that are important for this test
     """
-    important_biomarkers = set()
-    current_test = tests[current_test_index]
-
-    # Check which biomarkers are out of range in the current test.
-    for biomarker in current_test["biomarkers"]:
-        if is_value_out_of_range(
-            biomarker["value"], biomarker["low"], biomarker["high"]
-        ):
-            important_biomarkers.add(biomarker["name"])
-
-    # Check previous 3 tests for out-of-range biomarkers.
-    previous_test_start = max(0, current_test_index - 3)
-    for test_index in range(previous_test_start, current_test_index):
-        previous_test = tests[test_index]
-        for biomarker in previous_test["biomarkers"]:
-            if is_value_out_of_range(
-                biomarker["value"], biomarker["low"], biomarker["high"]
-            ):
-                important_biomarkers.add(biomarker["name"])
-
-    return important_biomarkers
+    # The out-of-range names are computed once per test in read_ods_tests, so each
+    # window is just the union of the current and previous 3 tests' sets.
+    window = tests[max(0, current_test_index - 3) : current_test_index + 1]
+    return set().union(*(test["out_of_range_names"] for test in window))
 
 
 def parse_test_date(date_string: str) -> datetime | None:
@@ -404,23 +471,21 @@ def get_historical_values(
     # Iterate from most recent to oldest.
     for test_index in range(current_test_index - 1, previous_test_start - 1, -1):
         test = tests[test_index]
-        # Find the biomarker in this test.
-        for biomarker in test["biomarkers"]:
-            if biomarker["name"] == biomarker_name:
-                history.append({"date": test["date"], "value": biomarker["value"]})
-                break
+        biomarker = test["biomarker_by_name"].get(biomarker_name)
+        if biomarker is not None:
+            history.append({"date": test["date"], "value": biomarker["value"]})
 
     return history
 
 
-def build_assessment_prompt(
+def format_test_details(
     test: dict[str, Any],
     important_biomarkers: set[str],
     tests: list[dict[str, Any]],
     current_test_index: int,
     today: datetime,
-) -> str:
-    """Build a prompt for Claude to assess the blood test results.
+) -> tuple[str, str, str]:
+    """Format the per-test parts of an assessment prompt.
 
     Args:
         test: The current test to assess
@@ -430,7 +495,7 @@ def build_assessment_prompt(
         today: Today's date for calculating relative times
 
     Returns:
-        Formatted prompt string
+        Tuple of (current_test_time_info, current_biomarkers_text, historical_text)
     """
     # Build biomarker summary for current test.
     biomarker_lines = []
@@ -494,13 +559,33 @@ def build_assessment_prompt(
     else:
         current_test_time_info = ""
 
-    prompt = textwrap.dedent(
-        f"""
+    return current_test_time_info, current_biomarkers_text, historical_text
+
+
+# The prompt templates are dedented once here, and only the per-test fields are
+# filled in for each prompt. Single and batch prompts ask for the same
+# assessment, so they share its instructions.
+_ASSESSMENT_INSTRUCTIONS = textwrap.dedent(
+    """
+    1. Highlights general trends (which biomarkers are improving, which are worsening)
+    2. Identifies any health concerns or areas that need attention
+    3. Notes any medically relevant patterns or relationships between biomarkers
+    4. Provides context about what these results might mean for overall health
+    5. Do not have a general title, but do have h3 in each section you may want to separate
+
+    Focus on actionable insights and meaningful trends rather than simply restating reference ranges.
+    Write in a clear, professional medical tone suitable for a patient reviewing their results.
+    """
+).strip()
+
+_ASSESSMENT_PROMPT_TEMPLATE = (
+    textwrap.dedent(
+        """
         You are a medical AI assistant analyzing blood test results. Please provide a concise assessment of the following blood test.
 
-        TODAY'S DATE: {today.strftime("%Y-%m-%d")}
-        TEST DATE: {test["date"]}{current_test_time_info}
-        LABORATORY: {test["lab"]}
+        TODAY'S DATE: {today}
+        TEST DATE: {date}{current_test_time_info}
+        LABORATORY: {lab}
 
         BIOMARKERS (⚠️ indicates biomarkers that are currently out of range or were out of range in the previous 3 tests):
 
@@ -508,27 +593,319 @@ def build_assessment_prompt(
         {historical_text}
 
         Please provide a brief medical assessment (2-4 paragraphs) that:
-        1. Highlights general trends (which biomarkers are improving, which are worsening)
-        2. Identifies any health concerns or areas that need attention
-        3. Notes any medically relevant patterns or relationships between biomarkers
-        4. Provides context about what these results might mean for overall health
-        5. Do not have a general title, but do have h3 in each section you may want to separate
-
-        Focus on actionable insights and meaningful trends rather than simply restating reference ranges.
-        Write in a clear, professional medical tone suitable for a patient reviewing their results.
         """
     ).strip()
+    + "\n"
+    + _ASSESSMENT_INSTRUCTIONS
+)
 
-    return prompt
+_BATCH_PROMPT_INTRODUCTION_TEMPLATE = textwrap.dedent(
+    """
+    You are a medical AI assistant analyzing blood test results. Please provide a concise assessment of each of the following {count} blood tests. Each test is enclosed in <<<TEST id="...">>> and <<</TEST>>> markers.
 
+    TODAY'S DATE: {today}
+    """
+).strip()
+
+_BATCH_PROMPT_INSTRUCTIONS = (
+    "For each test, please provide a brief medical assessment (2-4 paragraphs) that:\n"
+    + _ASSESSMENT_INSTRUCTIONS
+    + '\n\nEnclose each assessment in <<<ASSESSMENT id="...">>> and '
+    "<<</ASSESSMENT>>> markers, using the id of the test it assesses, and write "
+    "nothing outside the markers."
+)
 
-def generate_assessment_with_claude(
+
+def build_assessment_prompt(
+    test: dict[str, Any],
+    important_biomarkers: set[str],
+    tests: list[dict[str, Any]],
+    current_test_index: int,
+    today: datetime,
+) -> str:
+    """Build a prompt for Claude to assess the blood test results.
+
+    Args:
+        test: The current test to assess
+        important_biomarkers: Set of biomarker names that are important
+        tests: All tests for historical context
+        current_test_index: Index of current test in tests list
+        today: Today's date for calculating relative times
+
+    Returns:
+        Formatted prompt string
+    """
+    current_test_time_info, current_biomarkers_text, historical_text = (
+        format_test_details(
+            test, important_biomarkers, tests, current_test_index, today
+        )
+    )
+
+    return _ASSESSMENT_PROMPT_TEMPLATE.format(
+        today=today.strftime("%Y-%m-%d"),
+        date=test["date"],
+        current_test_time_info=current_test_time_info,
+        lab=test["lab"],
+        current_biomarkers_text=current_biomarkers_text,
+        historical_text=historical_text,
+    )
+
+
+def build_batch_assessment_prompt(
+    tests: list[dict[str, Any]],
+    batch: list[tuple[int, set[str]]],
+    today: datetime,
+) -> str:
+    """Build a single prompt asking Claude to assess several blood tests.
+
+    Each test is wrapped in <<<TEST id="row_index">>> markers, and Claude is asked
+    to wrap each assessment in matching <<<ASSESSMENT id="row_index">>> markers, so
+    the response can be split with parse_batch_assessments.
+
+    Args:
+        tests: All tests for historical context
+        batch: List of (test index, important biomarkers) pairs to assess
+        today: Today's date for calculating relative times
+
+    Returns:
+        Formatted prompt string
+    """
+    test_blocks = []
+    for current_test_index, important_biomarkers in batch:
+        test = tests[current_test_index]
+        current_test_time_info, current_biomarkers_text, historical_text = (
+            format_test_details(
+                test, important_biomarkers, tests, current_test_index, today
+            )
+        )
+        test_blocks.append(
+            f'<<<TEST id="{test["row_index"]}">>>\n'
+            f"TEST DATE: {test['date']}{current_test_time_info}\n"
+            f"LABORATORY: {test['lab']}\n\n"
+            "BIOMARKERS (⚠️ indicates biomarkers that are currently out of range or "
+            "were out of range in the previous 3 tests):\n\n"
+            f"{current_biomarkers_text}{historical_text}\n"
+            "<<</TEST>>>"
+        )
+
+    introduction = _BATCH_PROMPT_INTRODUCTION_TEMPLATE.format(
+        count=len(batch), today=today.strftime("%Y-%m-%d")
+    )
+    return "\n\n".join([introduction, *test_blocks, _BATCH_PROMPT_INSTRUCTIONS])
+
+
+def parse_batch_assessments(response_text: str) -> dict[int, str]:
+    """Split a response to a batch prompt into assessments keyed by row_index."""
+    return {
+        int(match["id"]): match["assessment"].strip()
+        for match in _BATCH_ASSESSMENT_RE.finditer(response_text)
+    }
+
+
+class RateLimiter:
+    """Pace request starts so that at most `max_rpm` happen in any minute.
+
+    Requests are spaced evenly, one every 60 / max_rpm seconds, so bursts from
+    the concurrent fan-out don't trip Anthropic's requests-per-minute limit.
+    """
+
+    def __init__(self, max_rpm: int) -> None:
+        self.interval = 60.0 / max_rpm
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        """Sleep until the next request slot is available."""
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+@functools.cache
+def _anthropic() -> Any:
+    """Import the Anthropic SDK on first use.
+
+    The SDK takes a while to import, and dry runs, --help and fully cached runs
+    never need it.
+    """
+    import anthropic
+
+    return anthropic
+
+
+def _is_retryable_error(exc: BaseException) -> bool:
+    """Return True for transient API errors (rate limits, overload, network)."""
+    anthropic = _anthropic()
+    if isinstance(exc, (anthropic.RateLimitError, anthropic.APIConnectionError)):
+        return True
+    return isinstance(exc, anthropic.APIStatusError) and exc.status_code >= 500
+
+
+_exponential_wait = wait_exponential_jitter(initial=1, max=60)
+
+
+def _wait_for_retry(retry_state: RetryCallState) -> float:
+    """Back off exponentially, but never for less than the server's Retry-After."""
+    wait = _exponential_wait(retry_state)
+
+    exc = retry_state.outcome.exception() if retry_state.outcome else None
+    if isinstance(exc, _anthropic().APIStatusError):
+        retry_after = exc.response.headers.get("retry-after")
+        try:
+            wait = max(wait, float(retry_after))
+        except (TypeError, ValueError):
+            pass
+
+    return wait
+
+
+@retry(
+    stop=stop_after_attempt(MAX_REQUEST_ATTEMPTS),
+    wait=_wait_for_retry,
+    retry=retry_if_exception(_is_retryable_error),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True,
+)
+async def _call_claude(
+    client: "anthropic.AsyncAnthropic",
+    model: str,
+    prompt: str,
+    semaphore: asyncio.Semaphore | None,
+    rate_limiter: RateLimiter | None,
+    max_tokens: int,
+) -> tuple[str, "anthropic.types.Usage"]:
+    """Stream a single-prompt request to Claude, retrying transient failures.
+
+    Returns:
+        Tuple of (response_text, usage)
+    """
+    # Pace first, so that requests waiting on the limiter don't hold a slot.
+    if rate_limiter is not None:
+        await rate_limiter.wait()
+
+    async with (
+        semaphore or contextlib.nullcontext(),
+        client.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.3,
+        ) as stream,
+    ):
+        chunks = [chunk async for chunk in stream.text_stream]
+        message = await stream.get_final_message()
+
+    return "".join(chunks), message.usage
+
+
+def create_anthropic_client() -> "anthropic.AsyncAnthropic":
+    """Create a Claude client from the ANTHROPIC_API_KEY environment variable.
+
+    Sharing one client between requests lets them reuse its connection pool, instead
+    of each paying for a new connection and TLS handshake.
+
+    Returns:
+        The client, with the SDK's own retries disabled, as _call_claude retries
+    """
+    api_key = os.environ.get("ANTHROPIC_API_KEY")
+    if not api_key:
+        raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
+    return _anthropic().AsyncAnthropic(api_key=api_key, max_retries=0)
+
+
+async def request_completion(
+    prompt: str,
+    model: str,
+    max_tokens: int,
+    semaphore: asyncio.Semaphore | None = None,
+    rate_limiter: RateLimiter | None = None,
+    cache: MutableMapping[str, dict[str, Any]] | None = None,
+    refresh_cache: bool = False,
+    client: "anthropic.AsyncAnthropic | None" = None,
+    cache_key_text: str | None = None,
+) -> str:
+    """Send a prompt to Claude and return the text of its response.
+
+    If a cache is given, responses are stored in it keyed by a hash of the model
+    and cache_key_text, which defaults to the prompt, so an identical request is
+    answered without calling the API.
+
+    Args:
+        prompt: The prompt to send
+        model: Anthropic model to use
+        max_tokens: Maximum number of tokens to generate
+        semaphore: Optional semaphore bounding the number of in-flight requests
+        rate_limiter: Optional limiter pacing requests per minute
+        cache: Optional persistent mapping of previously generated responses
+        refresh_cache: Ignore cached responses, but still store new ones
+        client: Client to send the request with, which is created from the
+            environment if not given
+        cache_key_text: Text identifying the request in the cache, if not the
+            prompt itself
+
+    Returns:
+        Response text generated by Claude
+    """
+    if cache_key_text is None:
+        cache_key_text = prompt
+    cache_key = hashlib.sha256((model + "\0" + cache_key_text).encode()).hexdigest()
+    if cache is not None and not refresh_cache and cache_key in cache:
+        logger.info("  Using cached assessment.")
+        return cache[cache_key]["assessment"]
+
+    if client is None:
+        client = create_anthropic_client()
+
+    logger.debug(
+        "\n%s\nPROMPT TO CLAUDE:\n%s\n%s\n%s\n", "=" * 80, "=" * 80, prompt, "=" * 80
+    )
+
+    response_text, usage = await _call_claude(
+        client, model, prompt, semaphore, rate_limiter, max_tokens
+    )
+    response_text = response_text.strip()
+
+    if cache is not None:
+        cache[cache_key] = {
+            "assessment": response_text,
+            "model": model,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens,
+        }
+
+    return response_text
+
+
+def _cache_reference_date(
+    tests: list[dict[str, Any]], test_indices: list[int], today: datetime
+) -> datetime:
+    """Return the date to write an assessment prompt's cache key as of.
+
+    Prompts state today's date and how long ago each test was, so a cache keyed on
+    them as of today would miss on every later day. Writing the key as of the latest
+    assessed test's date instead keeps it the same for as long as the data is.
+    """
+    test_dates = [parse_test_date(tests[index]["date"]) for index in test_indices]
+    return max((date for date in test_dates if date is not None), default=today)
+
+
+async def generate_assessment_with_claude(
     test: dict[str, Any],
     important_biomarkers: set[str],
     tests: list[dict[str, Any]],
     current_test_index: int,
     today: datetime,
     model: str = DEFAULT_ANTHROPIC_MODEL,
+    semaphore: asyncio.Semaphore | None = None,
+    rate_limiter: RateLimiter | None = None,
+    cache: MutableMapping[str, dict[str, Any]] | None = None,
+    refresh_cache: bool = False,
+    client: "anthropic.AsyncAnthropic | None" = None,
 ) -> str:
     """Generate an assessment for a blood test using Claude.
 
@@ -539,66 +916,185 @@ def generate_assessment_with_claude(
         current_test_index: Index of current test
         today: Today's date for calculating relative times
         model: Anthropic model to use
+        semaphore: Optional semaphore bounding the number of in-flight requests
+        rate_limiter: Optional limiter pacing requests per minute
+        cache: Optional persistent mapping of previously generated assessments
+        refresh_cache: Ignore cached assessments, but still store new ones
+        client: Optional client to send requests with
 
     Returns:
         Assessment text generated by Claude
     """
-    api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if not api_key:
-        raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
-
-    client = anthropic.Anthropic(api_key=api_key)
-
     prompt = build_assessment_prompt(
         test, important_biomarkers, tests, current_test_index, today
     )
+    cache_key_text = None
+    if cache is not None:
+        cache_key_text = build_assessment_prompt(
+            test,
+            important_biomarkers,
+            tests,
+            current_test_index,
+            _cache_reference_date(tests, [current_test_index], today),
+        )
+    return await request_completion(
+        prompt,
+        model,
+        ASSESSMENT_MAX_TOKENS,
+        semaphore=semaphore,
+        rate_limiter=rate_limiter,
+        cache=cache,
+        refresh_cache=refresh_cache,
+        client=client,
+        cache_key_text=cache_key_text,
+    )
+
+
+def model_max_output_tokens(model: str) -> int:
+    """Return the most output tokens a model allows in a single response."""
+    for prefix, max_tokens in _MODEL_MAX_OUTPUT_TOKENS:
+        if model.startswith(prefix):
+            return max_tokens
+    return FALLBACK_MAX_OUTPUT_TOKENS
 
-    print("\n" + "=" * 80, file=sys.stderr)
-    print("PROMPT TO CLAUDE:", file=sys.stderr)
-    print("=" * 80, file=sys.stderr)
-    print(prompt, file=sys.stderr)
-    print("=" * 80 + "\n", file=sys.stderr)
-
-    response = client.messages.create(
-        model=model,
-        max_tokens=2048,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.3,
+
+async def generate_batch_assessments_with_claude(
+    tests: list[dict[str, Any]],
+    batch: list[tuple[int, set[str]]],
+    today: datetime,
+    model: str = DEFAULT_ANTHROPIC_MODEL,
+    semaphore: asyncio.Semaphore | None = None,
+    rate_limiter: RateLimiter | None = None,
+    cache: MutableMapping[str, dict[str, Any]] | None = None,
+    refresh_cache: bool = False,
+    client: "anthropic.AsyncAnthropic | None" = None,
+) -> dict[int, str]:
+    """Generate assessments for several blood tests with a single Claude request.
+
+    Args:
+        tests: All tests for context
+        batch: List of (test index, important biomarkers) pairs to assess
+        today: Today's date for calculating relative times
+        model: Anthropic model to use
+        semaphore: Optional semaphore bounding the number of in-flight requests
+        rate_limiter: Optional limiter pacing requests per minute
+        cache: Optional persistent mapping of previously generated assessments
+        refresh_cache: Ignore cached assessments, but still store new ones
+        client: Optional client to send requests with
+
+    Returns:
+        Dictionary mapping row_index to assessment text. Tests that Claude didn't
+        return an assessment for are missing from it.
+    """
+    prompt = build_batch_assessment_prompt(tests, batch, today)
+    cache_key_text = None
+    if cache is not None:
+        cache_key_text = build_batch_assessment_prompt(
+            tests,
+            batch,
+            _cache_reference_date(tests, [index for index, _ in batch], today),
+        )
+    response_text = await request_completion(
+        prompt,
+        model,
+        # Past the model's limit, requests are rejected outright.
+        min(ASSESSMENT_MAX_TOKENS * len(batch), model_max_output_tokens(model)),
+        semaphore=semaphore,
+        rate_limiter=rate_limiter,
+        cache=cache,
+        refresh_cache=refresh_cache,
+        client=client,
+        cache_key_text=cache_key_text,
     )
+    return parse_batch_assessments(response_text)
+
 
-    assessment_text = response.content[0].text
-    return assessment_text.strip()
+def open_assessment_cache() -> "shelve.Shelf[dict[str, Any]]":
+    """Open the persistent assessment cache, creating its directory if needed."""
+    cache_path = ASSESSMENT_CACHE_PATH.expanduser()
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    return shelve.open(str(cache_path))
+
+
+def read_checkpoint(
+    checkpoint_path: pathlib.Path, tests: list[dict[str, Any]]
+) -> dict[int, str]:
+    """Read assessments saved by a previous, interrupted run.
+
+    Entries are only used if the row still holds a test with the same date, so a
+    checkpoint left over from before the spreadsheet was edited is ignored.
+
+    Args:
+        checkpoint_path: Path to the JSONL checkpoint file
+        tests: All tests read from the ODS file
+
+    Returns:
+        Dictionary mapping row_index to assessment text
+    """
+    if not checkpoint_path.is_file():
+        return {}
+
+    dates_by_row = {test["row_index"]: test["date"] for test in tests}
+    assessments = {}
+    with open(checkpoint_path, encoding="utf-8") as checkpoint_file:
+        for line in checkpoint_file:
+            try:
+                entry = json.loads(line)
+                if dates_by_row.get(entry["row_index"]) == entry["date"]:
+                    assessments[entry["row_index"]] = entry["assessment"]
+            except (json.JSONDecodeError, KeyError, TypeError):
+                # Most likely a partial line written while the process was killed,
+                # or one that isn't an entry at all.
+                continue
+
+    return assessments
+
+
+def append_checkpoint(
+    checkpoint_path: pathlib.Path, finished: list[tuple[dict[str, Any], str]]
+) -> None:
+    """Durably append finished assessments to the checkpoint file.
+
+    The file is opened for each append, so it's only created once an assessment
+    has been generated.
+
+    Args:
+        checkpoint_path: Path to the JSONL checkpoint file
+        finished: List of (test, assessment) pairs to append
+    """
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint_file:
+        for test, assessment in finished:
+            entry = {
+                "row_index": test["row_index"],
+                "date": test["date"],
+                "assessment": assessment,
+            }
+            checkpoint_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
 
 
 def write_assessments_to_ods(
-    ods_path: pathlib.Path,
+    document: OpenDocument,
+    table: Table,
     assessments: dict[int, str],
     assessment_column_index: int,
+    save_path: pathlib.Path,
 ) -> None:
-    """Write assessments back to the ODS file.
+    """Write assessments into an already loaded document and save it.
 
     Args:
-        ods_path: Path to the ODS file
+        document: The document returned by read_ods_tests
+        table: The table returned by read_ods_tests
         assessments: Dictionary mapping row_index to assessment text
         assessment_column_index: Column index for the Assessment column
+        save_path: Path to save the document to
     """
-    ods_path = ods_path.expanduser().resolve()
-    if not ods_path.is_file():
-        raise FileNotFoundError(f"OpenDocument file not found: {ods_path}")
-
-    # Load the document.
-    document = load(str(ods_path))
-
-    # Get the first table.
-    table: Table | None = None
-    for element in document.getElementsByType(Table):
-        table = element
-        break
-
-    if table is None:
-        raise ValueError("No table found in ODS file")
+    # Don't rewrite the file if there is nothing to change.
+    if not assessments:
+        return
 
-    rows = table.getElementsByType(TableRow)
+    rows = list(_iter_table_rows(table))
 
     # Write assessments to the appropriate rows.
     for row_index, assessment_text in assessments.items():
@@ -608,13 +1104,17 @@ def write_assessments_to_ods(
         row = rows[row_index]
         cells = list(row.childNodes)
 
-        # Find the assessment cell, handling repeated columns properly.
+        # Find the assessment cell, handling repeated columns properly. Remember the
+        # cell after it too, in case a repeated range has to be split around it.
         current_column_index = 0
         target_cell = None
+        next_sibling = None
         offset_in_repeat = 0
+        repeat = 1
 
         for cell_idx, cell in enumerate(cells):
-            repeat = int(cell.getAttribute("numbercolumnsrepeated") or "1")
+            raw_repeat = cell.getAttribute("numbercolumnsrepeated")
+            repeat = int(raw_repeat) if raw_repeat else 1
 
             # Check if the assessment column is within this cell's range.
             if (
@@ -623,21 +1123,20 @@ def write_assessments_to_ods(
                 < current_column_index + repeat
             ):
                 target_cell = cell
+                if cell_idx + 1 < len(cells):
+                    next_sibling = cells[cell_idx + 1]
                 offset_in_repeat = assessment_column_index - current_column_index
                 break
 
             current_column_index += repeat
 
         if target_cell is None:
-            print(
-                f"Warning: Could not find assessment cell for row {row_index}",
-                file=sys.stderr,
+            logger.warning(
+                f"Warning: Could not find assessment cell for row {row_index}"
             )
             continue
 
         # If the target cell is part of a repeated range, we need to split it.
-        repeat = int(target_cell.getAttribute("numbercolumnsrepeated") or "1")
-
         if repeat > 1:
             # We need to split the repeated cell into three parts:
             # 1. Cells before the target (if offset > 0)
@@ -645,8 +1144,7 @@ def write_assessments_to_ods(
             # 3. Cells after the target (if offset < repeat - 1)
 
             # Remove the repeated cell attribute from the target cell.
-            if target_cell.getAttribute("numbercolumnsrepeated"):
-                target_cell.removeAttribute("numbercolumnsrepeated")
+            target_cell.removeAttribute("numbercolumnsrepeated")
 
             # Create cells before if needed.
             if offset_in_repeat > 0:
@@ -661,16 +1159,6 @@ def write_assessments_to_ods(
                     "numbercolumnsrepeated", str(repeat - offset_in_repeat - 1)
                 )
                 # Insert after the target cell.
-                # Find the next sibling of target_cell.
-                next_sibling = None
-                for node in row.childNodes:
-                    if node == target_cell:
-                        # Get next sibling.
-                        idx = list(row.childNodes).index(node)
-                        if idx + 1 < len(row.childNodes):
-                            next_sibling = row.childNodes[idx + 1]
-                        break
-
                 if next_sibling:
                     row.insertBefore(after_cell, next_sibling)
                 else:
@@ -685,10 +1173,145 @@ def write_assessments_to_ods(
         target_cell.addElement(p)
 
     # Save the document.
-    document.save(str(ods_path))
+    document.save(str(save_path.expanduser().resolve()))
 
 
-def main() -> None:
+async def assess_tests(
+    tests: list[dict[str, Any]],
+    test_indices: list[int],
+    today: datetime,
+    model: str,
+    dry_run: bool,
+    semaphore: asyncio.Semaphore,
+    rate_limiter: RateLimiter | None,
+    cache: MutableMapping[str, dict[str, Any]] | None,
+    refresh_cache: bool,
+    checkpoint_path: pathlib.Path | None,
+    always_call_llm: bool = False,
+    client: "anthropic.AsyncAnthropic | None" = None,
+) -> dict[int, str]:
+    """Identify the important biomarkers for a batch of tests and assess them.
+
+    Tests without important biomarkers get IN_RANGE_ASSESSMENT, unless
+    always_call_llm is set. Of the rest, a batch of one test uses the regular
+    single-test prompt, larger batches are assessed together in a single Claude
+    request.
+
+    Args:
+        tests: All tests in chronological order
+        test_indices: Indices of the tests to assess
+        today: Today's date for calculating relative times
+        model: Anthropic model to use
+        dry_run: Generate dummy assessments instead of calling Claude
+        semaphore: Semaphore bounding the number of in-flight Claude requests
+        rate_limiter: Optional limiter pacing Claude requests per minute
+        cache: Optional persistent cache of previously generated assessments
+        refresh_cache: Ignore cached assessments, but still store new ones
+        checkpoint_path: Optional checkpoint file to append the finished
+            assessments to
+        always_call_llm: Ask Claude even about tests without important biomarkers
+        client: Optional client to send the Claude requests with
+
+    Returns:
+        Dictionary mapping row_index to assessment text
+    """
+    batch = []
+    for current_test_index in test_indices:
+        test = tests[current_test_index]
+        important_biomarkers = identify_important_biomarkers(tests, current_test_index)
+        logger.info(
+            f"\nProcessing test {current_test_index + 1}/{len(tests)}: {test['date']}"
+        )
+        logger.info(f"  Found {len(important_biomarkers)} important biomarkers.")
+        batch.append((current_test_index, important_biomarkers))
+
+    if dry_run:
+        logger.info("  Generating dummy assessments (dry-run mode)...")
+        return {
+            tests[idx][
+                "row_index"
+            ]: f"[DRY RUN] Assessment for test on {tests[idx]['date']} with {len(important)} important biomarkers."
+            for idx, important in batch
+        }
+
+    assessments: dict[int, str] = {}
+    if not always_call_llm:
+        in_range_indices = [idx for idx, important in batch if not important]
+        if in_range_indices:
+            logger.info("  No important biomarkers, skipping Claude.")
+        for idx in in_range_indices:
+            assessments[tests[idx]["row_index"]] = IN_RANGE_ASSESSMENT
+        batch = [(idx, important) for idx, important in batch if important]
+
+    if len(batch) == 1:
+        logger.info("  Generating assessment with Claude...")
+        current_test_index, important_biomarkers = batch[0]
+        test = tests[current_test_index]
+        assessments[test["row_index"]] = await generate_assessment_with_claude(
+            test,
+            important_biomarkers,
+            tests,
+            current_test_index,
+            today,
+            model,
+            semaphore=semaphore,
+            rate_limiter=rate_limiter,
+            cache=cache,
+            refresh_cache=refresh_cache,
+            client=client,
+        )
+    elif batch:
+        logger.info("  Generating assessment with Claude...")
+        assessments.update(
+            await generate_batch_assessments_with_claude(
+                tests,
+                batch,
+                today,
+                model,
+                semaphore=semaphore,
+                rate_limiter=rate_limiter,
+                cache=cache,
+                refresh_cache=refresh_cache,
+                client=client,
+            )
+        )
+
+    if checkpoint_path is not None:
+        finished = [
+            (tests[idx], assessments[tests[idx]["row_index"]])
+            for idx in test_indices
+            if tests[idx]["row_index"] in assessments
+        ]
+        if finished:
+            append_checkpoint(checkpoint_path, finished)
+
+    return assessments
+
+
+def configure_logging(verbose: bool = False) -> None:
+    """Send log messages to stderr from a background thread.
+
+    Coroutines only put records on a queue, so logging never blocks them on
+    writes to stderr. The listener is stopped, flushing the queue, at exit.
+
+    Args:
+        verbose: Whether to also log debug messages, such as the prompts sent
+            to Claude
+    """
+    log_queue: queue.Queue[logging.LogRecord] = queue.Queue(-1)
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    logger.propagate = False
+
+    listener.start()
+    atexit.register(listener.stop)
+
+
+async def amain() -> None:
     parser = argparse.ArgumentParser(
         description="Generate blood test assessments using Claude AI."
     )
@@ -715,20 +1338,70 @@ def main() -> None:
     parser.add_argument(
         "--force",
         action="store_true",
-        help="Force regeneration of assessments even if they already exist",
+        help=(
+            "Force regeneration of assessments even if they already exist, "
+            "without using cached ones"
+        ),
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        # Left as a string, so that argparse reports an invalid value like any other.
+        default=os.environ.get("ASSESSMENT_CONCURRENCY", str(DEFAULT_CONCURRENCY)),
+        help=(
+            "Maximum number of Claude requests in flight at once "
+            f"(default: $ASSESSMENT_CONCURRENCY or {DEFAULT_CONCURRENCY})"
+        ),
+    )
+    parser.add_argument(
+        "--max-rpm",
+        type=int,
+        help="Maximum number of Claude requests to start per minute (default: no limit)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Don't read or write the assessment cache ({ASSESSMENT_CACHE_PATH})",
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Regenerate assessments even if they are cached, and update the cache",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help=(
+            "Number of tests to assess in each Claude request, which share the "
+            "model's maximum output tokens (default: 1)"
+        ),
+    )
+    parser.add_argument(
+        "--always-call-llm",
+        action="store_true",
+        help="Ask Claude about every test, even ones without out-of-range biomarkers",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Also log the prompts sent to Claude",
     )
 
     args = parser.parse_args()
+    configure_logging(args.verbose)
 
     # Read the ODS file.
-    print("Reading blood test data from ODS file...", file=sys.stderr)
+    logger.info("Reading blood test data from ODS file...")
     try:
-        tests, biomarker_info, assessment_column_index = read_ods_tests(args.ods)
+        tests, biomarker_info, assessment_column_index, document, table = (
+            read_ods_tests(args.ods)
+        )
     except (FileNotFoundError, ValueError) as exc:
         parser.error(str(exc))
 
-    print(f"Found {len(tests)} tests in the spreadsheet.", file=sys.stderr)
-    print(f"Found {len(biomarker_info)} biomarker columns.", file=sys.stderr)
+    logger.info(f"Found {len(tests)} tests in the spreadsheet.")
+    logger.info(f"Found {len(biomarker_info)} biomarker columns.")
 
     # Sort tests chronologically (oldest first) by parsing dates.
     # This ensures historical lookups work correctly regardless of spreadsheet order.
@@ -740,9 +1413,8 @@ def main() -> None:
             tests_with_parsed_dates.append((parsed_date, test))
         else:
             # If date parsing fails, skip this test with a warning.
-            print(
-                f"Warning: Could not parse date '{test['date']}', skipping test",
-                file=sys.stderr,
+            logger.warning(
+                f"Warning: Could not parse date '{test['date']}', skipping test"
             )
             unparseable_tests.append(test)
 
@@ -750,90 +1422,169 @@ def main() -> None:
     tests = [test for _, test in tests_with_parsed_dates]
 
     if tests:
-        print(
-            f"Tests sorted chronologically from {tests[0]['date']} to {tests[-1]['date']}",
-            file=sys.stderr,
+        logger.info(
+            f"Tests sorted chronologically from {tests[0]['date']} to {tests[-1]['date']}"
         )
     if unparseable_tests:
-        print(
-            f"Skipped {len(unparseable_tests)} tests with unparseable dates",
-            file=sys.stderr,
+        logger.info(f"Skipped {len(unparseable_tests)} tests with unparseable dates")
+
+    # Pick up assessments finished by a previous run that didn't get to write them.
+    checkpoint_path = args.ods.with_suffix(".checkpoint.jsonl")
+    assessments_to_write = (
+        {} if args.dry_run else read_checkpoint(checkpoint_path, tests)
+    )
+    if assessments_to_write:
+        logger.info(
+            f"Resuming with {len(assessments_to_write)} checkpointed assessments."
         )
 
     # Process each test that doesn't have an assessment.
-    assessments_to_write = {}
     if args.force:
         tests_to_process = [(idx, test) for idx, test in enumerate(tests)]
     else:
         tests_to_process = [
             (idx, test) for idx, test in enumerate(tests) if not test["assessment"]
         ]
+    tests_to_process = [
+        (idx, test)
+        for idx, test in tests_to_process
+        if test["row_index"] not in assessments_to_write
+    ]
 
     # Apply limit if specified.
     if args.limit and args.limit > 0:
         tests_to_process = tests_to_process[: args.limit]
-        print(f"Limiting processing to {len(tests_to_process)} tests.", file=sys.stderr)
+        logger.info(f"Limiting processing to {len(tests_to_process)} tests.")
 
-    if not tests_to_process:
-        print("All tests already have assessments. Nothing to do.", file=sys.stderr)
+    if not tests_to_process and not assessments_to_write:
+        logger.info("All tests already have assessments. Nothing to do.")
         return
 
-    print(
-        f"\nProcessing {len(tests_to_process)} tests without assessments...",
-        file=sys.stderr,
-    )
+    logger.info(f"\nProcessing {len(tests_to_process)} tests without assessments...")
 
     today = datetime.now()
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+    rate_limiter = RateLimiter(args.max_rpm) if args.max_rpm else None
 
-    for idx, test in tests_to_process:
-        print(
-            f"\nProcessing test {idx + 1}/{len(tests)}: {test['date']}", file=sys.stderr
-        )
+    cache_context: contextlib.AbstractContextManager[Any] = (
+        contextlib.nullcontext()
+        if args.no_cache or args.dry_run
+        else open_assessment_cache()
+    )
 
-        # Identify important biomarkers.
-        important_biomarkers = identify_important_biomarkers(tests, idx)
-        print(
-            f"  Found {len(important_biomarkers)} important biomarkers.",
-            file=sys.stderr,
-        )
+    # Share a single client between all requests. Without an API key, requests
+    # that aren't answered from the cache fail individually, as they would anyway.
+    client = (
+        create_anthropic_client()
+        if os.environ.get("ANTHROPIC_API_KEY") and tests_to_process and not args.dry_run
+        else None
+    )
 
-        # Generate assessment with Claude.
-        try:
-            if args.dry_run:
-                print(
-                    "  Generating dummy assessment (dry-run mode)...", file=sys.stderr
+    # Split the tests into batches that are each assessed in a single request.
+    batch_size = max(1, args.batch_size)
+    batches = [
+        tests_to_process[start : start + batch_size]
+        for start in range(0, len(tests_to_process), batch_size)
+    ]
+
+    # Issue all batches concurrently and collect them in the original order.
+    try:
+        with cache_context as cache:
+            results = await asyncio.gather(
+                *(
+                    assess_tests(
+                        tests,
+                        [idx for idx, _ in batch],
+                        today,
+                        args.model,
+                        args.dry_run,
+                        semaphore,
+                        rate_limiter,
+                        cache,
+                        # Forced assessments would otherwise come back from the
+                        # cache.
+                        args.refresh_cache or args.force,
+                        # Dry-run assessments are dummies, so they are never
+                        # checkpointed.
+                        None if args.dry_run else checkpoint_path,
+                        args.always_call_llm,
+                        client,
+                    )
+                    for batch in batches
+                ),
+                return_exceptions=True,
+            )
+    finally:
+        if client is not None:
+            await client.close()
+
+    for batch, result in zip(batches, results):
+        for idx, test in batch:
+            if isinstance(result, BaseException):
+                logger.error(
+                    f"  ✗ Failed to generate assessment for {test['date']}: {result}"
                 )
-                assessment = f"[DRY RUN] Assessment for test on {test['date']} with {len(important_biomarkers)} important biomarkers."
-            else:
-                print("  Generating assessment with Claude...", file=sys.stderr)
-                assessment = generate_assessment_with_claude(
-                    test, important_biomarkers, tests, idx, today, args.model
+                continue
+
+            assessment = result.get(test["row_index"])
+            if assessment is None:
+                logger.error(
+                    f"  ✗ Failed to generate assessment for {test['date']}: "
+                    "missing from Claude's response"
                 )
+                continue
+
             assessments_to_write[test["row_index"]] = assessment
-            print(
-                f"  ✓ Assessment generated ({len(assessment)} characters)",
-                file=sys.stderr,
+            logger.info(
+                f"  ✓ Assessment for {test['date']} generated "
+                f"({len(assessment)} characters)"
             )
-        except Exception as exc:
-            print(f"  ✗ Failed to generate assessment: {exc}", file=sys.stderr)
-            continue
+
+    # Only rows whose assessment actually changed need to be written.
+    existing_assessments = {test["row_index"]: test["assessment"] for test in tests}
+    unchanged_rows = {
+        row_index
+        for row_index, assessment in assessments_to_write.items()
+        if existing_assessments.get(row_index) == assessment
+    }
+    if unchanged_rows:
+        logger.info(
+            f"\n{len(unchanged_rows)} assessments are unchanged and won't be rewritten."
+        )
+        for row_index in unchanged_rows:
+            del assessments_to_write[row_index]
 
     # Write assessments back to the ODS file.
     if assessments_to_write:
-        print(
-            f"\nWriting {len(assessments_to_write)} assessments back to ODS file...",
-            file=sys.stderr,
+        logger.info(
+            f"\nWriting {len(assessments_to_write)} assessments back to ODS file..."
         )
         try:
             write_assessments_to_ods(
-                args.ods, assessments_to_write, assessment_column_index
+                document,
+                table,
+                assessments_to_write,
+                assessment_column_index,
+                args.ods,
             )
-            print(f"✓ Successfully wrote assessments to {args.ods}", file=sys.stderr)
+            logger.info(f"✓ Successfully wrote assessments to {args.ods}")
+            # Everything in the checkpoint is now in the spreadsheet, unless this
+            # was a dry run, which didn't read it.
+            if not args.dry_run:
+                checkpoint_path.unlink(missing_ok=True)
         except Exception as exc:
-            print(f"✗ Failed to write assessments: {exc}", file=sys.stderr)
+            logger.error(f"✗ Failed to write assessments: {exc}")
             sys.exit(1)
+    elif unchanged_rows:
+        # Nothing to write, but the checkpoint is already reflected in the file.
+        if not args.dry_run:
+            checkpoint_path.unlink(missing_ok=True)
     else:
-        print("\nNo assessments were generated.", file=sys.stderr)
+        logger.info("\nNo assessments were generated.")
+
+
+def main() -> None:
+    asyncio.run(amain())
 
 
 if __name__ == "__main__":
@@ -1,37 +1,98 @@
 #!/usr/bin/env -S uv run --script
 # /// script
-# requires-python = ">=3.8"
+# requires-python = ">=3.10"
 # dependencies = [
-#     "odfpy",
 #     "anthropic",
+#     "pydantic",
 # ]
 # ///
 import argparse
+import asyncio
 import base64
+import hashlib
+import itertools
 import json
+import math
+import mmap
 import os
 import pathlib
 import re
-import subprocess
 import sys
 import tempfile
 import textwrap
+import zipfile
 from typing import Any
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
 
 import anthropic
-
-try:
-    from odf import teletype, text
-    from odf.opendocument import load
-    from odf.table import Table, TableRow, TableCell
-except ModuleNotFoundError as exc:  # pragma: no cover - dependency guard
-    raise ModuleNotFoundError(
-        "The 'odfpy' package is required to read OpenDocument files. "
-        "Install it with 'pip install odfpy'."
-    ) from exc
-
+import pydantic
 
 DEFAULT_ANTHROPIC_MODEL = "claude-sonnet-4-5"
+DEFAULT_CONCURRENCY = 5
+# Claude gets this many chances to fix results that fail validation.
+MAX_OCR_ATTEMPTS = 3
+BATCH_POLL_INTERVAL = 30
+OCR_CACHE_DIR = pathlib.Path("~/.cache/bt-ocr")
+FILES_API_BETA = "files-api-2025-04-14"
+# Claude is forced to call this tool, so its results arrive as validated JSON
+# instead of having to be scraped out of the text of its response.
+RECORD_RESULTS_TOOL: dict[str, Any] = {
+    "name": "record_results",
+    "description": (
+        "Record the lab name, date, and biomarkers extracted from blood test images."
+    ),
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "lab_name": {"type": ["string", "null"]},
+            "date": {"type": ["string", "null"], "description": "YYYY-MM-DD"},
+            "biomarkers": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string"},
+                        "value": {"type": ["number", "null"]},
+                        "unit": {"type": ["string", "null"]},
+                        "range_lower": {"type": ["number", "null"]},
+                        "range_upper": {"type": ["number", "null"]},
+                    },
+                    "required": ["name", "value"],
+                },
+            },
+        },
+        "required": ["lab_name", "date", "biomarkers"],
+    },
+}
+
+_TABLE_NAMESPACE = "urn:oasis:names:tc:opendocument:xmlns:table:1.0"
+_TEXT_NAMESPACE = "urn:oasis:names:tc:opendocument:xmlns:text:1.0"
+_TABLE_TAG = f"{{{_TABLE_NAMESPACE}}}table"
+_TABLE_ROW_TAG = f"{{{_TABLE_NAMESPACE}}}table-row"
+_COLUMNS_REPEATED_ATTRIBUTE = f"{{{_TABLE_NAMESPACE}}}number-columns-repeated"
+_LINE_BREAK_TAG = f"{{{_TEXT_NAMESPACE}}}line-break"
+_TAB_TAG = f"{{{_TEXT_NAMESPACE}}}tab"
+_SPACE_TAG = f"{{{_TEXT_NAMESPACE}}}s"
+_SPACE_COUNT_ATTRIBUTE = f"{{{_TEXT_NAMESPACE}}}c"
+_OFFICE_NAMESPACE = "urn:oasis:names:tc:opendocument:xmlns:office:1.0"
+# New rows are spliced into content.xml as text, using the standard namespace
+# prefixes that LibreOffice and odfpy write.
+_TABLE_START_RE = re.compile(r"<table:table(?=[\s/>])[^>]*>")
+_TABLE_ROW_RE = re.compile(
+    r"<table:table-row(?=[\s/>])[^>]*?(?:/>|>.*?</table:table-row>)", re.DOTALL
+)
+_TABLE_CELL_RE = re.compile(
+    r"<table:(?:covered-)?table-cell(?=[\s/>])[^>]*?"
+    r"(?:/>|>.*?</table:(?:covered-)?table-cell>)",
+    re.DOTALL,
+)
+_TABLE_ROW_END = "</table:table-row>"
+_HEADER_ROWS_END = "</table:table-header-rows>"
+# Claude downscales images whose long edge is longer than this many pixels, or
+# that have more than this many pixels in total.
+MAX_IMAGE_EDGE = 1568
+MAX_IMAGE_PIXELS = 1092 * 1092
 
 
 # This script will convert a PDF file of blood test results into a series of PNG
@@ -49,24 +110,441 @@ DEFAULT_ANTHROPIC_MODEL = "claude-sonnet-4-5"
 
 
 def encode_image(image_path: pathlib.Path) -> str:
-    """Encode an image file to base64 string."""
+    """Encode an image file to base64 string.
+
+    The file is memory-mapped and encoded straight from the mapping, so a large
+    page image isn't also read into memory as a separate bytes object. Encoding
+    it in chunks wouldn't lower the peak any further, as the whole encoded
+    string still has to be built for the request.
+    """
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+        # Empty files can't be mapped.
+        if os.fstat(image_file.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return base64.b64encode(mapped).decode("ascii")
+
+
+# The OCR instructions don't depend on the spreadsheet, so they come first in the
+# system prompt and stay byte-identical across every request, which lets Claude
+# cache them. The spreadsheet's lab and biomarker names follow them.
+_OCR_INSTRUCTIONS = textwrap.dedent(
+    """
+    Please analyze these blood test result images and extract the lab name, date, and all biomarker data.
+
+    LABORATORY NAME AND DATE:
+    - Extract the laboratory/clinic name from the images
+    - Extract the date of the test (return in YYYY-MM-DD format if possible)
+
+    BIOMARKERS: I have an existing spreadsheet with biomarker columns, whose names follow these instructions. You MUST follow the exact order and spelling of these biomarker names.
+
+    For each biomarker found in the images:
+    - If it matches one of the listed names, use the EXACT spelling and capitalization from the list
+    - Extract the value (as a number, not string), unit, and reference ranges
+    - Return biomarkers in the SAME ORDER as the list (only include biomarkers found in the images)
+
+    If you find biomarkers that are NOT in the list:
+    - Add them at the END of the results
+    - Follow the naming style/pattern of the existing biomarker names
+    - Use clear, consistent naming
+
+    For each biomarker, extract:
+    - name: The name of the biomarker/test (exact spelling from list, or new name for unlisted biomarkers)
+    - value: The numerical result (as a number, not string)
+    - unit: The unit of measurement
+    - range_lower: The lower end of the reference/normal range if provided
+    - range_upper: The upper end of the reference/normal range if provided
+
+    Record the data with the record_results tool, with this structure:
+    {
+        "lab_name": "Laboratory Name",
+        "date": "YYYY-MM-DD",
+        "biomarkers": [
+            {
+                "name": "Biomarker Name",
+                "value": 123.45,
+                "unit": "mg/dL",
+                "range_lower": 100,
+                "range_upper": 200
+            }
+        ]
+    }
+
+    Important:
+    - Extract the lab name and date from the top of the blood test report
+    - Extract ALL biomarkers visible in the images
+    - Use null for missing fields
+    - Ensure values are numbers, not strings
+    - Maintain the order: known biomarkers first (in list order), new biomarkers at the end
+    """
+).strip()
+
+_OCR_PROMPT_LAB_NAMES_TEMPLATE = textwrap.dedent(
+    """
+    LABORATORY NAMES: I have an existing list of lab names in my spreadsheet. If you can identify the lab name from the images, please choose from this list if possible:
+
+    {lab_names}
+
+    If the lab name in the image closely matches one of these (even with slight variations), use the EXACT name from the list above.
+    If it doesn't match any of these, use the lab name as written in the image.
+    """
+).strip()
+
+_OCR_PROMPT_BIOMARKERS_TEMPLATE = textwrap.dedent(
+    """
+    BIOMARKERS: These are the biomarker columns of my spreadsheet, in order:
+
+    {biomarker_names}
+    """
+).strip()
+
+
+def build_ocr_prompt(biomarker_names: list[str], lab_names: set[str]) -> str:
+    """Build the part of the OCR instructions that depends on the spreadsheet.
+
+    Args:
+        biomarker_names: List of known biomarker names to use as reference
+        lab_names: Set of known lab names to choose from
+
+    Returns:
+        Formatted prompt string, sent after _OCR_INSTRUCTIONS
+    """
+    # The names are listed compactly, and non-ASCII characters such as µ are kept
+    # as they are, because every character is paid for on every page.
+    sections = []
+    if lab_names:
+        sections.append(
+            _OCR_PROMPT_LAB_NAMES_TEMPLATE.format(
+                lab_names=json.dumps(
+                    sorted(lab_names), ensure_ascii=False, separators=(",", ":")
+                )
+            )
+        )
+    sections.append(
+        _OCR_PROMPT_BIOMARKERS_TEMPLATE.format(
+            biomarker_names=json.dumps(
+                biomarker_names, ensure_ascii=False, separators=(",", ":")
+            )
+        )
+    )
+    return "\n\n".join(sections)
+
+
+class OCRBiomarker(pydantic.BaseModel):
+    """A biomarker, as recorded with the record_results tool."""
+
+    name: str
+    value: int | float | None
+    unit: str | None = None
+    range_lower: int | float | None = None
+    range_upper: int | float | None = None
+
+
+class OCRResult(pydantic.BaseModel):
+    """The results of OCRing a page, as recorded with the record_results tool."""
 
+    lab_name: str | None = None
+    date: str | None = None
+    biomarkers: list[OCRBiomarker]
 
-def ocr_images_with_claude(
+
+def parse_ocr_response(content: list[Any]) -> dict[str, Any]:
+    """Return the results Claude recorded with the record_results tool.
+
+    Args:
+        content: Content blocks of Claude's response to a page request
+
+    Returns:
+        The recorded result, or a dict with "error" and "raw_response" keys if
+        the response doesn't contain a record_results call
+
+    Raises:
+        pydantic.ValidationError: If the recorded result doesn't match OCRResult
+    """
+    for block in content:
+        if block.type == "tool_use" and block.name == RECORD_RESULTS_TOOL["name"]:
+            return OCRResult.model_validate(block.input).model_dump()
+
+    # If Claude didn't record any results, return the raw text for debugging
+    response_text = "".join(block.text for block in content if block.type == "text")
+    print("Claude didn't record any OCR results", file=sys.stderr)
+    print(f"Raw response:\n{response_text}", file=sys.stderr)
+    return {"error": "No results recorded", "raw_response": response_text}
+
+
+def build_page_request(
+    prompt: str, image_source: dict[str, Any], model: str
+) -> dict[str, Any]:
+    """Build the messages.create parameters for OCRing a single page.
+
+    Args:
+        prompt: The spreadsheet's part of the instructions, from build_ocr_prompt
+        image_source: The source of the PNG image of the page, from _image_source
+        model: Anthropic model to use for OCR
+
+    Returns:
+        Dictionary of keyword arguments for messages.create
+    """
+    # Neither part of the system prompt changes between pages, so mark both as
+    # cacheable to let Claude reuse them across pages and PDFs instead of
+    # processing them again. The instructions are cached on their own too, so
+    # they're still reused after the spreadsheet gains a column or a lab.
+    system = [
+        {
+            "type": "text",
+            "text": _OCR_INSTRUCTIONS,
+            "cache_control": {"type": "ephemeral"},
+        },
+        {"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}},
+    ]
+    return {
+        "model": model,
+        "max_tokens": 4096,
+        "system": system,
+        "messages": [
+            {"role": "user", "content": [{"type": "image", "source": image_source}]}
+        ],
+        "temperature": 0,  # Use low temperature for more consistent extraction
+        "tools": [RECORD_RESULTS_TOOL],
+        "tool_choice": {"type": "tool", "name": RECORD_RESULTS_TOOL["name"]},
+    }
+
+
+class ImageUploader:
+    """Upload page images with the Files API, so requests can refer to them by ID.
+
+    The file IDs are stored on disk, keyed by the SHA-256 of each image, so
+    OCRing the same pages again, or in a batch after a failed run, doesn't
+    upload them again. Files can only be used with the API key's workspace, so
+    each key stores its IDs in a directory of its own.
+    """
+
+    def __init__(
+        self, client: anthropic.AsyncAnthropic, directory: pathlib.Path | None
+    ) -> None:
+        self.client = client
+        self.directory = None
+        if directory is not None:
+            key_digest = hashlib.sha256((client.api_key or "").encode()).hexdigest()
+            self.directory = directory.expanduser() / key_digest[:16]
+
+    def _id_path(self, image_data: bytes) -> pathlib.Path | None:
+        """Return the path the file ID of an image is stored at, if IDs are stored."""
+        if self.directory is None:
+            return None
+        return self.directory / f"{hashlib.sha256(image_data).hexdigest()}.txt"
+
+    async def image_source(
+        self, image_path: pathlib.Path, reupload: bool = False
+    ) -> dict[str, Any]:
+        """Return the source of an image, uploading it if it hasn't been already.
+
+        A stored ID is used as is, so if its file has been deleted since, requests
+        fail with a not-found error, and the image has to be uploaded again with
+        reupload set.
+        """
+        image_data = await asyncio.to_thread(image_path.read_bytes)
+        id_path = self._id_path(image_data)
+        if id_path is not None and not reupload and id_path.is_file():
+            return {"type": "file", "file_id": id_path.read_text().strip()}
+
+        uploaded = await self.client.beta.files.upload(
+            file=(image_path.name, image_data, "image/png")
+        )
+        if id_path is not None:
+            id_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = id_path.with_name(f"{id_path.name}.tmp")
+            temp_path.write_text(uploaded.id)
+            temp_path.replace(id_path)
+        return {"type": "file", "file_id": uploaded.id}
+
+    def forget(self, image_path: pathlib.Path) -> None:
+        """Delete the stored ID of an image, so that it's uploaded again next time."""
+        id_path = self._id_path(image_path.read_bytes())
+        if id_path is not None:
+            id_path.unlink(missing_ok=True)
+
+
+async def _image_source(
+    image_path: pathlib.Path, uploader: ImageUploader | None
+) -> dict[str, Any]:
+    """Return the source of a page image, uploaded or inline as base64."""
+    if uploader is not None:
+        return await uploader.image_source(image_path)
+
+    # Encode in a worker thread, so large images don't block the other pages.
+    encoded_image = await asyncio.to_thread(encode_image, image_path)
+    return {"type": "base64", "media_type": "image/png", "data": encoded_image}
+
+
+async def _ocr_page(
+    client: anthropic.AsyncAnthropic,
+    semaphore: asyncio.Semaphore,
+    prompt: str,
+    image_path: pathlib.Path,
+    model: str,
+    uploader: ImageUploader | None = None,
+) -> dict[str, Any]:
+    """OCR a single page image with Claude.
+
+    Args:
+        client: Client to send the request with
+        semaphore: Semaphore bounding the number of in-flight requests
+        prompt: The spreadsheet's part of the instructions, from build_ocr_prompt
+        image_path: Path to the PNG image of the page
+        model: Anthropic model to use for OCR
+        uploader: Uploader to send the image with the Files API, or None to send
+            it inline
+
+    Returns:
+        The parsed result for this page, as returned by parse_ocr_response, or
+        an error if Claude didn't record valid results in MAX_OCR_ATTEMPTS tries
+    """
+    # Requests that refer to uploaded files need the Files API beta.
+    extra_headers = {"anthropic-beta": FILES_API_BETA} if uploader else None
+    validation_error: pydantic.ValidationError | None = None
+    async with semaphore:
+        image_source = await _image_source(image_path, uploader)
+        request = build_page_request(prompt, image_source, model)
+        for attempt in range(MAX_OCR_ATTEMPTS):
+            try:
+                response = await client.messages.create(
+                    **request, extra_headers=extra_headers
+                )
+            except anthropic.NotFoundError:
+                # The image's stored file ID was used as is, and its file has been
+                # deleted since, so upload it again and send the request once more.
+                if uploader is None or attempt > 0:
+                    raise
+                print(f"{image_path.name}: uploading again", file=sys.stderr)
+                image_source = await uploader.image_source(image_path, reupload=True)
+                request = build_page_request(prompt, image_source, model)
+                response = await client.messages.create(
+                    **request, extra_headers=extra_headers
+                )
+            print(
+                f"{image_path.name}: {response.usage.input_tokens} input tokens, "
+                f"{response.usage.cache_read_input_tokens or 0} read from the cache",
+                file=sys.stderr,
+            )
+            try:
+                return parse_ocr_response(response.content)
+            except pydantic.ValidationError as exc:
+                validation_error = exc
+
+            print(
+                f"Claude recorded invalid OCR results for {image_path.name}: "
+                f"{validation_error}",
+                file=sys.stderr,
+            )
+            # Continue the conversation with the validation errors, so Claude
+            # can correct its results instead of reading the page from scratch.
+            tool_use = next(
+                block for block in response.content if block.type == "tool_use"
+            )
+            request["messages"] += [
+                {
+                    "role": "assistant",
+                    "content": [
+                        {
+                            "type": "tool_use",
+                            "id": tool_use.id,
+                            "name": tool_use.name,
+                            "input": tool_use.input,
+                        }
+                    ],
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "tool_result",
+                            "tool_use_id": tool_use.id,
+                            "content": (
+                                "The results are invalid, fix these errors and "
+                                f"record them again:\n{validation_error}"
+                            ),
+                            "is_error": True,
+                        }
+                    ],
+                },
+            ]
+
+    return {"error": f"Invalid results: {validation_error}", "raw_response": ""}
+
+
+def merge_ocr_results(page_results: list[dict[str, Any]]) -> dict[str, Any]:
+    """Merge the OCR results of the pages of one report into a single result.
+
+    The lab name and date are taken from the first page that has them, and the
+    biomarkers are concatenated in page order, keeping the first occurrence of any
+    biomarker that appears on more than one page.
+
+    Args:
+        page_results: Results of parse_ocr_response, one per page, in page order
+
+    Returns:
+        The merged result, or an error naming the first page that couldn't be
+        parsed, as a report missing some of its pages would look complete
+    """
+    failed_pages = [
+        page_number
+        for page_number, result in enumerate(page_results, start=1)
+        if "error" in result
+    ]
+    if failed_pages:
+        first_error = page_results[failed_pages[0] - 1]
+        if len(page_results) == 1:
+            return first_error
+        return {
+            "error": (
+                f"{len(failed_pages)} of {len(page_results)} pages failed, page "
+                f"{failed_pages[0]}: {first_error['error']}"
+            ),
+            "raw_response": first_error.get("raw_response", ""),
+        }
+
+    merged: dict[str, Any] = {"biomarkers": []}
+    seen_names: set[str] = set()
+    for result in page_results:
+        for key in ("lab_name", "date"):
+            if key not in merged and result.get(key):
+                merged[key] = result[key]
+
+        for biomarker in result.get("biomarkers") or []:
+            normalized_name = (biomarker.get("name") or "").strip().lower()
+            if normalized_name in seen_names:
+                continue
+            if normalized_name:
+                seen_names.add(normalized_name)
+            merged["biomarkers"].append(biomarker)
+
+    return merged
+
+
+async def ocr_images_with_claude(
     image_paths: list[pathlib.Path],
-    biomarker_names: list[str] = [],
-    lab_names: set[str] = set(),
+    biomarker_names: list[str] | None = None,
+    lab_names: set[str] | None = None,
     model: str = DEFAULT_ANTHROPIC_MODEL,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    files_api: bool = False,
+    file_ids_dir: pathlib.Path | None = None,
 ) -> dict[str, Any]:
     """OCR blood test images using Claude and extract biomarker data.
 
+    Each page is sent in its own request, and the requests run concurrently.
+
     Args:
         image_paths: List of paths to PNG images to process
         biomarker_names: Optional list of known biomarker names to use as reference
         lab_names: Optional set of known lab names to choose from
         model: Anthropic model to use for OCR
+        concurrency: Maximum number of pages to OCR at once
+        files_api: Whether to upload the images with the Files API instead of
+            sending them inline
+        file_ids_dir: Directory to store the IDs of uploaded images in, or None
+            to always upload them
 
     Returns:
         Dictionary containing extracted biomarker data with structure:
@@ -88,286 +566,550 @@ def ocr_images_with_claude(
     if not api_key:
         raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
 
-    client = anthropic.Anthropic(api_key=api_key)
+    async with anthropic.AsyncAnthropic(api_key=api_key) as client:
+        prompt = build_ocr_prompt(biomarker_names or [], lab_names or set())
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        uploader = ImageUploader(client, file_ids_dir) if files_api else None
 
-    # Prepare the prompt
-    lab_names_section = ""
-    if lab_names:
-        lab_names_section = textwrap.dedent(
-            f"""
+        page_results = await asyncio.gather(
+            *(
+                _ocr_page(client, semaphore, prompt, image_path, model, uploader)
+                for image_path in image_paths
+            )
+        )
+    return merge_ocr_results(page_results)
 
-            LABORATORY NAMES: I have an existing list of lab names in my spreadsheet. If you can identify the lab name from the images, please choose from this list if possible:
 
-            {json.dumps(list(lab_names), indent=2)}
+async def ocr_pdfs_with_batch(
+    pdf_images: list[list[pathlib.Path]],
+    biomarker_names: list[str],
+    lab_names: set[str],
+    model: str = DEFAULT_ANTHROPIC_MODEL,
+    files_api: bool = False,
+    file_ids_dir: pathlib.Path | None = None,
+) -> list[dict[str, Any]]:
+    """OCR the pages of several PDFs with a single Message Batches API request.
 
-            If the lab name in the image closely matches one of these (even with slight variations), use the EXACT name from the list above.
-            If it doesn't match any of these, use the lab name as written in the image.
-        """
-        )
+    Batches cost half as much as regular requests, but Anthropic processes them
+    whenever it has capacity, which can take minutes or, rarely, hours.
 
-    prompt = textwrap.dedent(
-        f"""
-            Please analyze these blood test result images and extract the lab name, date, and all biomarker data.
-
-            LABORATORY NAME AND DATE:
-            - Extract the laboratory/clinic name from the images
-            - Extract the date of the test (return in YYYY-MM-DD format if possible)
-            {lab_names_section}
-
-            BIOMARKERS: I have an existing spreadsheet with biomarker columns. You MUST follow the exact order and spelling of these biomarker names:
-
-            {json.dumps(biomarker_names, indent=2)}
-
-            For each biomarker found in the images:
-            - If it matches one of the above names, use the EXACT spelling and capitalization from the list
-            - Extract the value (as a number, not string), unit, and reference ranges
-            - Return biomarkers in the SAME ORDER as the list above (only include biomarkers found in the images)
-
-            If you find biomarkers that are NOT in the above list:
-            - Add them at the END of the results
-            - Follow the naming style/pattern of the existing biomarker names
-            - Use clear, consistent naming
-
-            For each biomarker, extract:
-            - name: The name of the biomarker/test (exact spelling from list, or new name for unlisted biomarkers)
-            - value: The numerical result (as a number, not string)
-            - unit: The unit of measurement
-            - range_lower: The lower end of the reference/normal range if provided
-            - range_upper: The upper end of the reference/normal range if provided
-
-            Return the data as a JSON object with this exact structure:
-            {{
-                "lab_name": "Laboratory Name",
-                "date": "YYYY-MM-DD",
-                "biomarkers": [
-                    {{
-                        "name": "Biomarker Name",
-                        "value": 123.45,
-                        "unit": "mg/dL",
-                        "range_lower": 100,
-                        "range_upper": 200
-                    }}
-                ]
-            }}
-
-            Important:
-            - Extract the lab name and date from the top of the blood test report
-            - Extract ALL biomarkers visible in the images
-            - Use null for missing fields
-            - Ensure values are numbers, not strings
-            - Maintain the order: known biomarkers first (in list order), new biomarkers at the end
-        """
-    ).strip()
+    Args:
+        pdf_images: The page images of each PDF, in page order
+        biomarker_names: List of known biomarker names to use as reference
+        lab_names: Set of known lab names to choose from
+        model: Anthropic model to use for OCR
+        files_api: Whether to upload the images with the Files API instead of
+            sending them inline
+        file_ids_dir: Directory to store the IDs of uploaded images in, or None
+            to always upload them
 
-    # Prepare image content for the API
-    content: list[dict[str, Any]] = [
-        {"type": "text", "text": prompt},
-    ]
+    Returns:
+        One merged result per PDF, in the same order as pdf_images
+    """
+    api_key = os.environ.get("ANTHROPIC_API_KEY")
+    if not api_key:
+        raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
 
-    # Add all images to the message
-    for image_path in image_paths:
-        encoded_image = encode_image(image_path)
-        content.append(
-            {
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/png",
-                    "data": encoded_image,
-                },
+    async with anthropic.AsyncAnthropic(api_key=api_key) as client:
+        prompt = build_ocr_prompt(biomarker_names, lab_names)
+        uploader = ImageUploader(client, file_ids_dir) if files_api else None
+
+        # Encode or upload the pages concurrently, as many at once as when OCRing
+        # them one request at a time.
+        semaphore = asyncio.Semaphore(DEFAULT_CONCURRENCY)
+
+        async def page_request(
+            pdf_index: int, page_index: int, image_path: pathlib.Path
+        ) -> dict[str, Any]:
+            async with semaphore:
+                image_source = await _image_source(image_path, uploader)
+            return {
+                "custom_id": f"pdf{pdf_index}-page{page_index}",
+                "params": build_page_request(prompt, image_source, model),
             }
-        )
 
-    messages = [
-        {
-            "role": "user",
-            "content": content,
+        image_paths = {
+            f"pdf{pdf_index}-page{page_index}": image_path
+            for pdf_index, images in enumerate(pdf_images)
+            for page_index, image_path in enumerate(images)
         }
+        requests: list[Any] = await asyncio.gather(
+            *(
+                page_request(pdf_index, page_index, image_path)
+                for pdf_index, images in enumerate(pdf_images)
+                for page_index, image_path in enumerate(images)
+            )
+        )
+
+        # Requests that refer to uploaded files need the Files API beta.
+        extra_headers = {"anthropic-beta": FILES_API_BETA} if uploader else None
+        batch = await client.messages.batches.create(
+            requests=requests, extra_headers=extra_headers
+        )
+        print(
+            f"Submitted batch {batch.id} with {len(requests)} pages, waiting for it...",
+            file=sys.stderr,
+        )
+        while batch.processing_status != "ended":
+            await asyncio.sleep(BATCH_POLL_INTERVAL)
+            batch = await client.messages.batches.retrieve(batch.id)
+
+        page_results: dict[str, dict[str, Any]] = {}
+        async for entry in await client.messages.batches.results(batch.id):
+            if entry.result.type != "succeeded":
+                error = f"Batch request {entry.custom_id} {entry.result.type}"
+                if entry.result.type == "errored":
+                    error += f": {entry.result.error.error.message}"
+                    # The page's file was deleted since its ID was stored, so
+                    # it's uploaded again when the PDF is next OCRed.
+                    if (
+                        uploader is not None
+                        and entry.result.error.error.type == "not_found_error"
+                    ):
+                        uploader.forget(image_paths[entry.custom_id])
+                print(error, file=sys.stderr)
+                page_results[entry.custom_id] = {"error": error, "raw_response": ""}
+                continue
+
+            # Batched requests can't be retried with feedback, so pages with invalid
+            # results fail their report like failed ones.
+            try:
+                page_results[entry.custom_id] = parse_ocr_response(
+                    entry.result.message.content
+                )
+            except pydantic.ValidationError as exc:
+                print(f"Claude recorded invalid OCR results: {exc}", file=sys.stderr)
+                page_results[entry.custom_id] = {
+                    "error": f"Invalid results: {exc}",
+                    "raw_response": "",
+                }
+
+    # A page missing from the results only fails the PDF it belongs to.
+    missing_page = {"error": "Missing from the batch results", "raw_response": ""}
+    return [
+        merge_ocr_results(
+            [
+                page_results.get(f"pdf{pdf_index}-page{page_index}", missing_page)
+                for page_index in range(len(images))
+            ]
+        )
+        for pdf_index, images in enumerate(pdf_images)
     ]
 
-    # Make the API call
-    response = client.messages.create(
-        model=model,
-        max_tokens=4096,
-        messages=messages,
-        temperature=0,  # Use low temperature for more consistent extraction
-    )
 
-    # Extract JSON from the response
-    response_text = response.content[0].text
+async def _run_poppler(
+    command: list[str], failure_message: str, capture_stdout: bool = True
+) -> str:
+    """Run a poppler-utils command without blocking the event loop.
 
-    # Try to parse the JSON response
+    Args:
+        command: The command and its arguments
+        failure_message: Message of the RuntimeError raised if the command fails
+        capture_stdout: Whether to read the standard output of the command, or
+            send it to /dev/null for commands that write their output to files
+
+    Returns:
+        The standard output of the command, or "" if it wasn't captured
+    """
     try:
-        # Look for JSON in the response (it might be wrapped in markdown code blocks)
-        json_match = re.search(
-            r"```(?:json)?\s*(\{.*?\})\s*```", response_text, re.DOTALL
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=(
+                asyncio.subprocess.PIPE
+                if capture_stdout
+                else asyncio.subprocess.DEVNULL
+            ),
+            stderr=asyncio.subprocess.PIPE,
         )
-        if json_match:
-            json_str = json_match.group(1)
-        else:
-            # Try to find raw JSON
-            json_str = response_text
+    except FileNotFoundError as exc:
+        raise FileNotFoundError(
+            f"{command[0]} command not found. Install poppler-utils and try again."
+        ) from exc
+
+    stdout, stderr = await process.communicate()
+    if process.returncode:
+        details = stderr.decode(errors="replace").strip()
+        raise RuntimeError(
+            f"{failure_message}: {details}" if details else failure_message
+        )
+    return stdout.decode(errors="replace") if capture_stdout else ""
+
+
+async def read_pdf_layout(pdf_path: pathlib.Path) -> tuple[int, int]:
+    """Return the number of pages of a PDF, and the long edge to render them at.
+
+    The long edge is the largest one Claude uses for the first page's aspect
+    ratio, as reported by pdfinfo, since Claude would downscale bigger images
+    anyway, and they would only take longer to render, encode and upload.
+    """
+    info = await _run_poppler(
+        ["pdfinfo", str(pdf_path)], "pdfinfo failed to read the PDF"
+    )
+
+    match = re.search(r"^Pages:\s*(\d+)", info, re.MULTILINE)
+    if match is None:
+        raise RuntimeError("pdfinfo didn't report the number of pages in the PDF")
+    page_count = int(match.group(1))
+
+    long_edge = MAX_IMAGE_EDGE
+    size_match = re.search(r"^Page size:\s*([\d.]+) x ([\d.]+)", info, re.MULTILINE)
+    if size_match is not None:
+        width, height = (float(size) for size in size_match.groups())
+        if width > 0 and height > 0:
+            aspect_ratio = max(width, height) / min(width, height)
+            long_edge = min(long_edge, int(math.sqrt(MAX_IMAGE_PIXELS * aspect_ratio)))
+    return page_count, long_edge
+
+
+class OCRCache:
+    """Store OCR results on disk, keyed by the PDF and everything sent with it.
+
+    Each result is a small JSON file named after its key, so processing a PDF
+    again with the same spreadsheet and model doesn't call Claude.
+    """
+
+    def __init__(self, directory: pathlib.Path) -> None:
+        self.directory = directory.expanduser()
+
+    @staticmethod
+    def key(pdf_path: pathlib.Path, model: str, prompt: str) -> str:
+        """Return the cache key of OCRing a PDF with the given model and prompt.
+
+        The prompt contains the spreadsheet's biomarker and lab names, so adding a
+        column or a lab leads to a new key, and so does changing the instructions.
+        Every part is prefixed with its length, so different parts can't run
+        together into the same bytes.
+        """
+        digest = hashlib.sha256()
+        with open(pdf_path, "rb") as pdf_file:
+            digest.update(os.fstat(pdf_file.fileno()).st_size.to_bytes(8, "little"))
+            for chunk in iter(lambda: pdf_file.read(1 << 20), b""):
+                digest.update(chunk)
+        for part in (model.encode(), _OCR_INSTRUCTIONS.encode(), prompt.encode()):
+            digest.update(len(part).to_bytes(8, "little"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        """Return the cached result for a key, or None if there isn't a valid one."""
+        try:
+            with open(self.directory / f"{key}.json", encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def set(self, key: str, result: dict[str, Any]) -> None:
+        """Store a result, replacing the file atomically so it's never half-written.
+
+        Results with an error, which include reports with any page that failed, are
+        not stored, so that the PDF is OCRed again next time.
+        """
+        if "error" in result:
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temp_path = self.directory / f"{key}.json.tmp"
+        with open(temp_path, "w", encoding="utf-8") as cache_file:
+            json.dump(result, cache_file)
+        temp_path.replace(self.directory / f"{key}.json")
+
+
+def deduplicate_images(image_paths: list[pathlib.Path]) -> list[pathlib.Path]:
+    """Return the images without any that are identical to an earlier one.
+
+    Reports often repeat a legend page or end with blank pages, and there's no
+    point paying for Claude to read the same image more than once.
+    """
+    seen_digests: set[bytes] = set()
+    unique_paths = []
+    for image_path in image_paths:
+        digest = hashlib.sha256(image_path.read_bytes()).digest()
+        if digest not in seen_digests:
+            seen_digests.add(digest)
+            unique_paths.append(image_path)
+    return unique_paths
 
-        result = json.loads(json_str)
-        return result
-    except json.JSONDecodeError as exc:
-        # If we can't parse JSON, return the raw text for debugging
-        print(f"Failed to parse JSON response: {exc}", file=sys.stderr)
-        print(f"Raw response:\n{response_text}", file=sys.stderr)
-        return {"error": "Failed to parse JSON", "raw_response": response_text}
 
+async def convert_pdf_to_images(
+    pdf_path: pathlib.Path, prefix: str, semaphore: asyncio.Semaphore
+) -> pathlib.Path:
+    """Render each page of a PDF to a PNG image in a new temporary directory.
 
-def convert_pdf_to_images(pdf_path: pathlib.Path, prefix: str) -> pathlib.Path:
+    Args:
+        pdf_path: Path to the PDF file
+        prefix: Filename prefix for the generated images
+        semaphore: Semaphore bounding the number of pdftoppm processes, shared
+            between all the PDFs being converted
+
+    Returns:
+        Path to the temporary directory with the images
+    """
     pdf_path = pdf_path.expanduser().resolve()
     if not pdf_path.is_file():
         raise FileNotFoundError(f"PDF not found: {pdf_path}")
 
     temp_dir = pathlib.Path(tempfile.mkdtemp(prefix="bt-ocr-"))
-    output_prefix = temp_dir / prefix
-
-    command = [
-        "pdftoppm",
-        "-png",
-        "-r",
-        "300",
-        str(pdf_path),
-        str(output_prefix),
-    ]
+    page_count, long_edge = await read_pdf_layout(pdf_path)
+    # Pad the page numbers, so the images sort in page order.
+    digits = len(str(page_count))
+
+    async def render_page(page: int) -> None:
+        command = [
+            "pdftoppm",
+            "-png",
+            "-scale-to",
+            str(long_edge),
+            "-f",
+            str(page),
+            "-l",
+            str(page),
+            "-singlefile",
+            str(pdf_path),
+            str(temp_dir / f"{prefix}-{page:0{digits}d}"),
+        ]
+        async with semaphore:
+            await _run_poppler(
+                command, "pdftoppm failed to convert the PDF", capture_stdout=False
+            )
 
-    try:
-        subprocess.run(command, check=True)
-    except FileNotFoundError as exc:
-        raise FileNotFoundError(
-            "pdftoppm command not found. Install poppler-utils and try again."
-        ) from exc
-    except subprocess.CalledProcessError as exc:
-        raise RuntimeError("pdftoppm failed to convert the PDF") from exc
+    # pdftoppm renders pages one after another, so run one process per page. Each
+    # process opens the PDF on its own, which makes this safe to do in parallel.
+    await asyncio.gather(*(render_page(page) for page in range(1, page_count + 1)))
 
     return temp_dir
 
 
-def extract_columns_from_open_document_first_row(
+async def convert_pdfs_to_images(
+    pdf_paths: list[pathlib.Path], prefix: str
+) -> list[pathlib.Path]:
+    """Convert several PDFs at once, with one pdftoppm process per CPU at most.
+
+    Returns:
+        The temporary directory with the images of each PDF, in the same order
+    """
+    semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+    return await asyncio.gather(
+        *(convert_pdf_to_images(pdf_path, prefix, semaphore) for pdf_path in pdf_paths)
+    )
+
+
+async def read_inputs(
+    ods_path: pathlib.Path, pdf_paths: list[pathlib.Path], prefix: str
+) -> tuple[tuple[list[str], bool, set[str]], list[pathlib.Path]]:
+    """Read the spreadsheet while the PDFs are being converted to images.
+
+    Reading the spreadsheet doesn't depend on the images, so it runs in a thread
+    alongside the pdftoppm processes instead of before them.
+
+    Args:
+        ods_path: Path to the OpenDocument spreadsheet
+        pdf_paths: Paths to the PDF files
+        prefix: Filename prefix for the generated images
+
+    Returns:
+        What read_open_document returns for the spreadsheet, and the temporary
+        directory with the images of each PDF
+
+    Raises:
+        FileNotFoundError: If the spreadsheet or a PDF doesn't exist
+        ValueError: If the spreadsheet can't be read
+        RuntimeError: If a PDF can't be converted
+    """
+    spreadsheet, temp_dirs = await asyncio.gather(
+        asyncio.to_thread(read_open_document, ods_path),
+        convert_pdfs_to_images(pdf_paths, prefix),
+        return_exceptions=True,
+    )
+    # Report a problem with the spreadsheet first, as when it was read up front.
+    if isinstance(spreadsheet, BaseException):
+        raise spreadsheet
+    if isinstance(temp_dirs, BaseException):
+        raise temp_dirs
+    return spreadsheet, temp_dirs
+
+
+def _element_text(element: ElementTree.Element) -> str:
+    """Return the text of an element, like odfpy's teletype.extractText does."""
+    parts = [element.text or ""]
+    for child in element:
+        if child.tag == _LINE_BREAK_TAG:
+            parts.append("\n")
+        elif child.tag == _TAB_TAG:
+            parts.append("\t")
+        elif child.tag == _SPACE_TAG:
+            parts.append(" " * int(child.get(_SPACE_COUNT_ATTRIBUTE) or "1"))
+        else:
+            parts.append(_element_text(child))
+        parts.append(child.tail or "")
+    return "".join(parts)
+
+
+def read_open_document(
     odf_path: pathlib.Path,
-) -> tuple[list[str], bool]:
-    """Return the biomarker column names and whether an assessment column exists.
+) -> tuple[list[str], bool, set[str]]:
+    """Return the biomarker columns, whether there's an assessment column, and labs.
+
+    The rows of content.xml are streamed once, collecting both the header and the
+    lab names, and reading stops at the end of the lab names instead of building
+    the whole document in memory.
 
     The assessment column, if present, should always be the last column in the spreadsheet.
     This function separates it from the biomarker columns so new biomarkers can be inserted
     before assessment rather than after it.
 
+    The lab names are read from the second column (index 1), below the header, up to
+    the first empty row.
+
     Returns:
-        Tuple of (biomarker_columns, has_assessment) where:
+        Tuple of (biomarker_columns, has_assessment, lab_names) where:
         - biomarker_columns: List of biomarker column names (excluding assessment)
         - has_assessment: True if the last column is "assessment"
+        - lab_names: Set of the lab names already in the spreadsheet
     """
 
     odf_path = odf_path.expanduser().resolve()
     if not odf_path.is_file():
         raise FileNotFoundError(f"OpenDocument file not found: {odf_path}")
 
+    columns: list[str] | None = None
+    lab_names: list[str] = []
     try:
-        document = load(str(odf_path))
-    except Exception as exc:  # noqa: BLE001
+        with (
+            zipfile.ZipFile(odf_path) as archive,
+            archive.open("content.xml") as content,
+        ):
+            tables_seen = 0
+            for event, element in ElementTree.iterparse(
+                content, events=("start", "end")
+            ):
+                # Only read the rows of the first table.
+                if event == "start":
+                    if element.tag == _TABLE_TAG:
+                        tables_seen += 1
+                        if tables_seen > 1:
+                            break
+                    continue
+                if element.tag != _TABLE_ROW_TAG:
+                    continue
+
+                cells: list[str] = []
+                for cell in element:
+                    # Only the lab name is needed from the rows below the header,
+                    # so the text of the biomarker cells isn't extracted.
+                    if columns is not None and len(cells) > 1:
+                        break
+                    repeat = int(cell.get(_COLUMNS_REPEATED_ATTRIBUTE, "1"))
+                    text_content = _element_text(cell).strip()
+                    # Empty header cells are dropped and only the lab name is read
+                    # from the other rows, so two copies of an empty cell keep the
+                    # lab name's index right without expanding the padding
+                    # spreadsheets add to the end of every row.
+                    if not text_content:
+                        repeat = min(repeat, 2)
+                    cells.extend(itertools.repeat(text_content, repeat))
+                # Rows that have been read aren't needed anymore.
+                element.clear()
+
+                # Empty header cells are ignored, and the biomarker columns start
+                # after Date and Lab name.
+                if columns is None:
+                    columns = [cell for cell in cells if cell][2:]
+
+                # Get the second column (index 1)
+                if len(cells) > 1:
+                    lab_name = cells[1].strip()
+                    if lab_name:
+                        lab_names.append(lab_name)
+                    else:
+                        # Stop at the first empty row in the second column
+                        break
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as exc:
         raise ValueError("Invalid OpenDocument file") from exc
 
-    table: Table | None = None
-    for element in document.getElementsByType(Table):
-        table = element
-        break
-
-    if table is None:
-        return [], False
-
-    for row in table.getElementsByType(TableRow):
-        cells: list[str] = []
-
-        for cell in row.childNodes:
-            repeat = int(cell.getAttribute("numbercolumnsrepeated") or "1")
-            text_content = teletype.extractText(cell).strip()
-            if text_content:
-                cells.extend([text_content] * repeat)
+    if columns is None:
+        return [], False, set()
 
-        columns = cells[2:]
+    # The first "lab name" is the header of the column.
+    lab_name_set = set(lab_names[1:])
 
-        # Check if the last column is "assessment" (case-insensitive).
-        if columns and columns[-1].strip().lower() == "assessment":
-            return columns[:-1], True
+    # Check if the last column is "assessment" (case-insensitive).
+    if columns and columns[-1].strip().lower() == "assessment":
+        return columns[:-1], True, lab_name_set
 
-        return columns, False
+    return columns, False, lab_name_set
 
-    return [], False
 
+_BIOMARKER_TABLE_HEADER = (
+    f"{'Biomarker':<30} {'Value':>10} {'Unit':<10} {'Reference Range':<20}"
+)
 
-def extract_lab_names_from_open_document(
-    odf_path: pathlib.Path,
-) -> set[str]:
-    """Return the lab names from the second column (index 1) up to the first empty row."""
 
-    odf_path = odf_path.expanduser().resolve()
-    if not odf_path.is_file():
-        raise FileNotFoundError(f"OpenDocument file not found: {odf_path}")
+def _format_reference_range(biomarker: dict[str, Any]) -> str:
+    """Format the reference range of a biomarker, or "" if it doesn't have one."""
+    range_lower = biomarker.get("range_lower")
+    range_upper = biomarker.get("range_upper")
+    if range_lower is not None and range_upper is not None:
+        return f"{range_lower}-{range_upper}"
+    if range_lower is not None:
+        return f"≥{range_lower}"
+    if range_upper is not None:
+        return f"≤{range_upper}"
+    return ""
 
-    try:
-        document = load(str(odf_path))
-    except Exception as exc:  # noqa: BLE001
-        raise ValueError("Invalid OpenDocument file") from exc
 
-    table: Table | None = None
-    for element in document.getElementsByType(Table):
-        table = element
-        break
+def _format_biomarker_row(name: str, biomarker: dict[str, Any]) -> str:
+    """Format a biomarker as a row of the table format_ocr_results_for_display prints."""
+    value = biomarker.get("value")
+    value_str = str(value) if value is not None else "N/A"
+    unit = biomarker.get("unit") or ""
+    ref_range = _format_reference_range(biomarker)
+    return f"{name:<30} {value_str:>10} {unit:<10} {ref_range:<20}"
 
-    if table is None:
-        return set()
 
-    lab_names: list[str] = []
-    for row in table.getElementsByType(TableRow):
-        cells: list[str] = []
+def normalize_biomarker_names(biomarker_names: list[str]) -> dict[str, str]:
+    """Map the normalized form of each biomarker column name to the name itself.
 
-        for cell in row.childNodes:
-            repeat = int(cell.getAttribute("numbercolumnsrepeated") or "1")
-            text_content = teletype.extractText(cell).strip()
-            cells.extend([text_content] * repeat)
+    OCR names are matched to the columns by stripping whitespace and lowercasing
+    them, so they match even if Claude didn't copy a name exactly.
 
-        # Get the second column (index 1)
-        if len(cells) > 1:
-            lab_name = cells[1].strip()
-            if lab_name:
-                lab_names.append(lab_name)
-            else:
-                # Stop at the first empty row in the second column
-                break
+    Args:
+        biomarker_names: The biomarker column names of the spreadsheet
 
-    return set(lab_names[1:])
+    Returns:
+        Dictionary from each normalized name to the exact name in the spreadsheet
+    """
+    return {name.strip().lower(): name for name in biomarker_names}
 
 
 def format_ocr_results_for_display(
-    ocr_result: dict[str, Any], existing_biomarkers: list[str]
+    ocr_result: dict[str, Any], normalized_existing: dict[str, str]
 ) -> str:
     """Format OCR results in a nice human-readable table.
 
     Args:
         ocr_result: Dictionary containing OCR results with lab_name, date, and biomarkers
-        existing_biomarkers: List of existing biomarker column names from the spreadsheet
+        normalized_existing: The existing biomarker column names, as returned by
+            normalize_biomarker_names
 
     Returns:
         Formatted string with table showing all recognized information
     """
-    lines = []
-    lines.append("=" * 80)
-    lines.append("OCR RESULTS")
-    lines.append("=" * 80)
-    lines.append("")
-    lines.append(f"Lab name: {ocr_result.get('lab_name', 'N/A')}")
-    lines.append(f"Date: {ocr_result.get('date', 'N/A')}")
-    lines.append("")
-
-    # Create normalized lookup for matching
-    normalized_existing = {name.strip().lower(): name for name in existing_biomarkers}
+    lines = [
+        "=" * 80,
+        "OCR RESULTS",
+        "=" * 80,
+        "",
+        f"Lab name: {ocr_result.get('lab_name', 'N/A')}",
+        f"Date: {ocr_result.get('date', 'N/A')}",
+        "",
+    ]
 
-    # Categorize biomarkers as matched or new
-    matched_biomarkers = []
-    new_biomarkers = []
+    # Categorize biomarkers as matched or new, keeping the names and the
+    # biomarkers in parallel lists.
+    matched_names: list[str] = []
+    matched_biomarkers: list[dict[str, Any]] = []
+    new_names: list[str] = []
+    new_biomarkers: list[dict[str, Any]] = []
 
     for biomarker in ocr_result.get("biomarkers", []):
         name = biomarker.get("name") or ""
@@ -377,74 +1119,21 @@ def format_ocr_results_for_display(
         normalized_name = name.strip().lower()
 
         if normalized_name in normalized_existing:
-            matched_name = normalized_existing[normalized_name]
-            matched_biomarkers.append((matched_name, biomarker, True))
+            matched_names.append(normalized_existing[normalized_name])
+            matched_biomarkers.append(biomarker)
         else:
-            new_biomarkers.append((name, biomarker, False))
-
-    # Print matched biomarkers first
-    if matched_biomarkers:
-        lines.append("MATCHED TO EXISTING COLUMNS:")
-        lines.append("-" * 80)
-        lines.append(
-            f"{'Biomarker':<30} {'Value':>10} {'Unit':<10} {'Reference Range':<20}"
-        )
-        lines.append("-" * 80)
-
-        for spreadsheet_name, biomarker, _ in matched_biomarkers:
-            value = biomarker.get("value")
-            unit = biomarker.get("unit") or ""
-            range_lower = biomarker.get("range_lower")
-            range_upper = biomarker.get("range_upper")
-
-            # Format value for display.
-            value_str = str(value) if value is not None else "N/A"
-
-            # Format reference range.
-            if range_lower is not None and range_upper is not None:
-                ref_range = f"{range_lower}-{range_upper}"
-            elif range_lower is not None:
-                ref_range = f"≥{range_lower}"
-            elif range_upper is not None:
-                ref_range = f"≤{range_upper}"
-            else:
-                ref_range = ""
-
-            lines.append(
-                f"{spreadsheet_name:<30} {value_str:>10} {unit:<10} {ref_range:<20}"
-            )
-        lines.append("")
-
-    # Print new biomarkers
-    if new_biomarkers:
-        lines.append("NEW BIOMARKERS (will be added as new columns):")
-        lines.append("-" * 80)
-        lines.append(
-            f"{'Biomarker':<30} {'Value':>10} {'Unit':<10} {'Reference Range':<20}"
-        )
-        lines.append("-" * 80)
-
-        for name, biomarker, _ in new_biomarkers:
-            value = biomarker.get("value")
-            unit = biomarker.get("unit") or ""
-            range_lower = biomarker.get("range_lower")
-            range_upper = biomarker.get("range_upper")
-
-            # Format value for display.
-            value_str = str(value) if value is not None else "N/A"
-
-            # Format reference range.
-            if range_lower is not None and range_upper is not None:
-                ref_range = f"{range_lower}-{range_upper}"
-            elif range_lower is not None:
-                ref_range = f"≥{range_lower}"
-            elif range_upper is not None:
-                ref_range = f"≤{range_upper}"
-            else:
-                ref_range = ""
-
-            lines.append(f"{name:<30} {value_str:>10} {unit:<10} {ref_range:<20}")
-        lines.append("")
+            new_names.append(name)
+            new_biomarkers.append(biomarker)
+
+    # Print matched biomarkers first, then new ones.
+    for title, names, biomarkers in (
+        ("MATCHED TO EXISTING COLUMNS:", matched_names, matched_biomarkers),
+        ("NEW BIOMARKERS (will be added as new columns):", new_names, new_biomarkers),
+    ):
+        if names:
+            lines.extend((title, "-" * 80, _BIOMARKER_TABLE_HEADER, "-" * 80))
+            lines.extend(map(_format_biomarker_row, names, biomarkers))
+            lines.append("")
 
     # Summary
     lines.append("=" * 80)
@@ -491,48 +1180,129 @@ def format_biomarker_column_name(biomarker: dict[str, Any]) -> str:
     return " ".join(parts)
 
 
+def _read_content_xml(odf_path: pathlib.Path) -> str:
+    """Return the content.xml of an OpenDocument file, if it can be spliced as text."""
+    try:
+        with zipfile.ZipFile(odf_path) as archive:
+            content = archive.read("content.xml").decode("utf-8")
+    except (zipfile.BadZipFile, KeyError) as exc:
+        raise ValueError("Invalid OpenDocument file") from exc
+
+    for prefix, namespace in (
+        ("office", _OFFICE_NAMESPACE),
+        ("table", _TABLE_NAMESPACE),
+        ("text", _TEXT_NAMESPACE),
+    ):
+        if f'xmlns:{prefix}="{namespace}"' not in content:
+            raise ValueError(
+                f"Unsupported OpenDocument file: no standard '{prefix}' namespace prefix"
+            )
+    return content
+
+
+def _replace_content_xml(odf_path: pathlib.Path, content: str) -> None:
+    """Replace the content.xml of an OpenDocument file, copying the other members."""
+    temp_path = odf_path.with_name(f"{odf_path.name}.tmp")
+    with (
+        zipfile.ZipFile(odf_path) as source,
+        zipfile.ZipFile(temp_path, "w") as destination,
+    ):
+        # ODF requires the mimetype to be the first member, stored uncompressed.
+        members = sorted(
+            source.infolist(), key=lambda info: info.filename != "mimetype"
+        )
+        for info in members:
+            if info.filename == "mimetype":
+                info.compress_type = zipfile.ZIP_STORED
+            if info.filename == "content.xml":
+                destination.writestr(info, content.encode("utf-8"))
+            else:
+                destination.writestr(info, source.read(info))
+    temp_path.replace(odf_path)
+
+
+def _table_cell_xml(
+    text_content: str | None = None, attributes: dict[str, str] | None = None
+) -> str:
+    """Serialize a table cell, with a paragraph of text if any is given."""
+    attributes_xml = "".join(
+        f" {name}={quoteattr(value)}" for name, value in (attributes or {}).items()
+    )
+    if text_content is None:
+        return f"<table:table-cell{attributes_xml}/>"
+    return (
+        f"<table:table-cell{attributes_xml}>"
+        f"<text:p>{escape(text_content)}</text:p></table:table-cell>"
+    )
+
+
+def _insert_header_cells(
+    header_row: str, cells_xml: str, insert_index: int | None
+) -> str:
+    """Insert serialized cells into the header row, before the cell at insert_index.
+
+    Without an index, the cells are inserted before the repeated empty columns at
+    the end of the row, if there are any. Otherwise, they're appended to the row.
+    """
+    if header_row.endswith("/>"):
+        header_row = f"{header_row[:-2]}>{_TABLE_ROW_END}"
+
+    cells = list(_TABLE_CELL_RE.finditer(header_row))
+    insert_at = len(header_row) - len(_TABLE_ROW_END)
+    if insert_index is not None:
+        if insert_index < len(cells):
+            insert_at = cells[insert_index].start()
+    elif cells:
+        last_cell_tag = cells[-1].group(0).split(">", 1)[0]
+        if "table:number-columns-repeated=" in last_cell_tag:
+            insert_at = cells[-1].start()
+
+    return header_row[:insert_at] + cells_xml + header_row[insert_at:]
+
+
 def write_results_to_ods(
     odf_path: pathlib.Path,
     ocr_result: dict[str, Any],
     existing_biomarkers: list[str],
+    normalized_existing: dict[str, str],
     has_assessment: bool,
-) -> None:
+) -> list[str]:
     """Write OCR results to the ODS file by inserting a new row at position 2.
 
+    The row is spliced into content.xml as text, and every other member of the
+    archive is copied over unchanged, instead of parsing the whole document into
+    odfpy and serializing it out again.
+
     Args:
         odf_path: Path to the ODS file
         ocr_result: Dictionary containing OCR results with lab_name, date, and biomarkers
         existing_biomarkers: List of existing biomarker column names from the header
+        normalized_existing: The same names, as returned by normalize_biomarker_names
         has_assessment: Whether the spreadsheet has an assessment column as the last column
+
+    Returns:
+        The biomarker columns of the spreadsheet after the write, so the
+        spreadsheet doesn't have to be read again to OCR another PDF
     """
     odf_path = odf_path.expanduser().resolve()
     if not odf_path.is_file():
         raise FileNotFoundError(f"OpenDocument file not found: {odf_path}")
 
-    # Load the document
-    document = load(str(odf_path))
-
-    # Get the first table
-    table: Table | None = None
-    for element in document.getElementsByType(Table):
-        table = element
-        break
+    content = _read_content_xml(odf_path)
 
-    if table is None:
+    # Find the header row of the first table.
+    table_match = _TABLE_START_RE.search(content)
+    if table_match is None:
         raise ValueError("No table found in ODS file")
-
-    # Get all rows
-    rows = table.getElementsByType(TableRow)
-    if len(rows) < 1:
+    header_match = _TABLE_ROW_RE.search(content, table_match.end())
+    if header_match is None or header_match.start() > content.find(
+        "</table:table>", table_match.end()
+    ):
         raise ValueError("ODS file must have at least a header row")
 
     # Parse the biomarkers from the OCR result.
     # Store full biomarker objects (not just values) to preserve units and reference ranges.
     biomarkers_dict = {}
-    biomarkers_order = []
-
-    # Create a normalized lookup for existing biomarkers (strip whitespace, lowercase).
-    normalized_existing = {name.strip().lower(): name for name in existing_biomarkers}
 
     for biomarker in ocr_result.get("biomarkers", []):
         name = biomarker.get("name") or ""
@@ -549,12 +1319,11 @@ def write_results_to_ods(
             # New biomarker not in existing list - format according to convention.
             formatted_name = format_biomarker_column_name(biomarker)
             biomarkers_dict[formatted_name] = biomarker
-            biomarkers_order.append(formatted_name)
 
-    # Determine if there are new biomarkers (maintain order from OCR result)
-    new_biomarkers = [
-        name for name in biomarkers_order if name not in existing_biomarkers
-    ]
+    # Determine if there are new biomarkers. The dictionary keeps the order of
+    # the OCR result, and holds each name once even if it was read twice.
+    existing_set = frozenset(existing_biomarkers)
+    new_biomarkers = [name for name in biomarkers_dict if name not in existing_set]
 
     # Detailed column mapping output.
     print("\n" + "=" * 80, file=sys.stderr)
@@ -585,97 +1354,80 @@ def write_results_to_ods(
     print("=" * 80 + "\n", file=sys.stderr)
 
     # Update header row if there are new biomarkers.
+    header_row = header_match.group(0)
     if new_biomarkers:
-        header_row = rows[0]
-
-        # Find where to insert new columns: before "assessment" if it exists, otherwise before repeated empty columns.
-        header_cells = list(header_row.childNodes)
-        insert_before = None
-
-        if has_assessment:
-            # Find the assessment cell by looking for the cell with "assessment" text.
-            # Count from the beginning: Date (0), Lab name (1), then biomarkers start at index 2.
-            # Assessment should be at index 2 + len(existing_biomarkers).
-            assessment_index = 2 + len(existing_biomarkers)
-            if assessment_index < len(header_cells):
-                insert_before = header_cells[assessment_index]
-        else:
-            # No assessment column, insert before repeated empty columns.
-            if header_cells:
-                last_cell = header_cells[-1]
-                # If the last cell has numbercolumnsrepeated, insert new cells before it.
-                if last_cell.getAttribute("numbercolumnsrepeated"):
-                    insert_before = last_cell
-
-        # Add the new biomarker columns.
-        for new_biomarker in new_biomarkers:
-            cell = TableCell()
-            p = text.P(text=new_biomarker)
-            cell.addElement(p)
-            if insert_before:
-                header_row.insertBefore(cell, insert_before)
-            else:
-                header_row.addElement(cell)
-
-    # Create the new data row
-    new_row = TableRow()
+        header_row = _insert_header_cells(
+            header_row,
+            "".join(_table_cell_xml(name) for name in new_biomarkers),
+            # Count from the beginning: Date (0), Lab name (1), then biomarkers
+            # start at index 2, so assessment should be at the index after them.
+            2 + len(existing_biomarkers) if has_assessment else None,
+        )
 
+    # Create the new data row.
     # First column: Date
-    date_cell = TableCell()
     date_value = ocr_result.get("date", "")
-    if date_value:
-        # Set as date value to avoid the leading single quote.
-        date_cell.setAttribute("valuetype", "date")
-        date_cell.setAttribute("datevalue", date_value)
-    date_p = text.P(text=date_value)
-    date_cell.addElement(date_p)
-    new_row.addElement(date_cell)
-
-    # Second column: Lab name
-    lab_cell = TableCell()
-    lab_p = text.P(text=ocr_result.get("lab_name", ""))
-    lab_cell.addElement(lab_p)
-    new_row.addElement(lab_cell)
+    # Set as date value to avoid the leading single quote.
+    date_attributes = (
+        {"office:value-type": "date", "office:date-value": date_value}
+        if date_value
+        else {}
+    )
+    new_cells = [
+        _table_cell_xml(date_value, date_attributes),
+        # Second column: Lab name
+        _table_cell_xml(ocr_result.get("lab_name", "")),
+    ]
 
     # Add biomarker columns (existing + new).
     all_biomarkers = existing_biomarkers + new_biomarkers
     for biomarker_name in all_biomarkers:
-        cell = TableCell()
         biomarker_obj = biomarkers_dict.get(biomarker_name)
-
-        if biomarker_obj is not None:
-            # Extract the value from the biomarker object.
-            cell_value = biomarker_obj.get("value")
-
-            if cell_value is not None and cell_value != "":
-                # Set as numeric value to avoid the leading single quote.
-                cell.setAttribute("valuetype", "float")
-                cell.setAttribute("value", str(cell_value))
-                p = text.P(text=str(cell_value))
-                cell.addElement(p)
-        # Leave cell empty if no biomarker or value.
-
-        new_row.addElement(cell)
+        cell_value = biomarker_obj.get("value") if biomarker_obj is not None else None
+
+        if cell_value is not None and cell_value != "":
+            # Set as numeric value to avoid the leading single quote.
+            new_cells.append(
+                _table_cell_xml(
+                    str(cell_value),
+                    {"office:value-type": "float", "office:value": str(cell_value)},
+                )
+            )
+        else:
+            # Leave cell empty if no biomarker or value.
+            new_cells.append(_table_cell_xml())
 
     # Add assessment column if it exists (always last, always empty for OCR results).
     if has_assessment:
-        assessment_cell = TableCell()
-        new_row.addElement(assessment_cell)
-
-    # Insert the new row at position 1 (right after header, which is at position 0)
-    # This will push the existing row 2 down
-    table.insertBefore(new_row, rows[1] if len(rows) > 1 else None)
+        new_cells.append(_table_cell_xml())
+    new_row = f"<table:table-row>{''.join(new_cells)}</table:table-row>"
+
+    # Insert the new row right after the header, which pushes the existing row 2
+    # down. A header inside a header rows group stays alone in it.
+    insert_at = header_match.end()
+    if content.startswith(_HEADER_ROWS_END, insert_at):
+        insert_at += len(_HEADER_ROWS_END)
+    content = (
+        content[: header_match.start()]
+        + header_row
+        + content[header_match.end() : insert_at]
+        + new_row
+        + content[insert_at:]
+    )
 
     # Save the document
-    document.save(str(odf_path))
+    _replace_content_xml(odf_path, content)
     print(f"Results written to {odf_path}", file=sys.stderr)
+    return all_biomarkers
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="Convert a PDF of blood test results to PNG images and OCR them with Claude to extract biomarker data."
     )
-    parser.add_argument("pdf", type=pathlib.Path, help="Path to the PDF file")
+    parser.add_argument(
+        "pdf", type=pathlib.Path, nargs="+", help="Path to the PDF file(s)"
+    )
     parser.add_argument(
         "--prefix",
         default="page",
@@ -700,6 +1452,39 @@ def main() -> None:
         action="store_true",
         help="Skip OCR and only convert PDF to images",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Maximum number of pages to OCR at once (default: {DEFAULT_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help=(
+            "OCR all pages with the Message Batches API, at half the price, "
+            "but waiting for Anthropic to get to the batch"
+        ),
+    )
+    parser.add_argument(
+        "--files-api",
+        action="store_true",
+        help=(
+            "Upload page images with the Files API (beta) and refer to them by ID, "
+            "so the same image is only uploaded once"
+        ),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=pathlib.Path,
+        default=OCR_CACHE_DIR,
+        help=f"Directory to cache OCR results in (default: {OCR_CACHE_DIR})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't read or write cached OCR results",
+    )
     parser.add_argument(
         "--output",
         type=pathlib.Path,
@@ -707,56 +1492,137 @@ def main() -> None:
     )
 
     args = parser.parse_args()
+    if args.output and len(args.pdf) > 1:
+        parser.error("--output can only be used with a single PDF")
 
     try:
-        biomarker_names, has_assessment = extract_columns_from_open_document_first_row(
-            args.ods
+        spreadsheet, temp_dirs = asyncio.run(
+            read_inputs(args.ods, args.pdf, args.prefix)
         )
-        lab_names = extract_lab_names_from_open_document(args.ods)
     except (FileNotFoundError, ValueError) as exc:
         parser.error(str(exc))
-
-    try:
-        temp_dir = convert_pdf_to_images(args.pdf, args.prefix)
-    except FileNotFoundError as exc:
-        parser.error(str(exc))
     except RuntimeError as exc:
         print(str(exc), file=sys.stderr)
         raise SystemExit(1) from exc
-
-    images = sorted(temp_dir.glob(f"{args.prefix}-*.png"))
-    if not images:
-        print("No images were generated.", file=sys.stderr)
-        raise SystemExit(1)
+    biomarker_names, has_assessment, lab_names = spreadsheet
+
+    pdf_images: list[list[pathlib.Path]] = []
+    for pdf_path, temp_dir in zip(args.pdf, temp_dirs):
+        images = sorted(temp_dir.glob(f"{args.prefix}-*.png"))
+        if not images:
+            print(f"No images were generated for {pdf_path}.", file=sys.stderr)
+            raise SystemExit(1)
+
+        if args.no_ocr:
+            # Just print the image paths without performing OCR
+            print(temp_dir)
+            for image_path in images:
+                print(image_path)
+            continue
+
+        unique_images = deduplicate_images(images)
+        if len(unique_images) < len(images):
+            print(
+                f"Skipping {len(images) - len(unique_images)} duplicate pages "
+                f"of {pdf_path}.",
+                file=sys.stderr,
+            )
+        pdf_images.append(unique_images)
 
     if args.no_ocr:
-        # Just print the image paths without performing OCR
-        print(temp_dir)
-        for image_path in images:
-            print(image_path)
-    else:
-        # Perform OCR on the images using Claude (default behavior)
-        print("Performing OCR on images with Claude...", file=sys.stderr)
-        try:
-            result = ocr_images_with_claude(
-                images, biomarker_names, lab_names, args.model
-            )
+        return
+
+    cache = None if args.no_cache else OCRCache(args.cache_dir)
+    file_ids_dir = None if args.no_cache else args.cache_dir / "files"
+
+    # Perform OCR on the images using Claude (default behavior)
+    print("Performing OCR on images with Claude...", file=sys.stderr)
+    try:
+        results: list[dict[str, Any] | None] = [None] * len(args.pdf)
+        if args.batch:
+            # Every PDF in a batch is OCRed with the spreadsheet as it is now.
+            prompt = build_ocr_prompt(biomarker_names, lab_names)
+            keys = [OCRCache.key(pdf_path, args.model, prompt) for pdf_path in args.pdf]
+            if cache is not None:
+                results = [cache.get(key) for key in keys]
+            uncached = [index for index, result in enumerate(results) if result is None]
+            for index in set(range(len(args.pdf))) - set(uncached):
+                print(
+                    f"Using cached OCR results for {args.pdf[index]}.", file=sys.stderr
+                )
+            if uncached:
+                batch_results = asyncio.run(
+                    ocr_pdfs_with_batch(
+                        [pdf_images[index] for index in uncached],
+                        biomarker_names,
+                        lab_names,
+                        args.model,
+                        args.files_api,
+                        file_ids_dir,
+                    )
+                )
+                for index, batch_result in zip(uncached, batch_results):
+                    results[index] = batch_result
+                    if cache is not None:
+                        cache.set(keys[index], batch_result)
+
+        failed = False
+        for pdf_index, (pdf_path, images) in enumerate(zip(args.pdf, pdf_images)):
+            result = results[pdf_index]
+            if result is None:
+                prompt = build_ocr_prompt(biomarker_names, lab_names)
+                key = OCRCache.key(pdf_path, args.model, prompt)
+                result = cache.get(key) if cache is not None else None
+                if result is None:
+                    result = asyncio.run(
+                        ocr_images_with_claude(
+                            images,
+                            biomarker_names,
+                            lab_names,
+                            args.model,
+                            args.concurrency,
+                            args.files_api,
+                            file_ids_dir,
+                        )
+                    )
+                    if cache is not None:
+                        cache.set(key, result)
+                else:
+                    print(f"Using cached OCR results for {pdf_path}.", file=sys.stderr)
+
+            # Don't add an empty row for a PDF that couldn't be read.
+            if "error" in result:
+                print(f"OCR failed for {pdf_path}: {result['error']}", file=sys.stderr)
+                failed = True
+                continue
 
             # Display OCR results in a nice format for verification.
-            print("\n" + format_ocr_results_for_display(result, biomarker_names))
+            if len(args.pdf) > 1:
+                print(f"\n{pdf_path}:")
+            normalized_existing = normalize_biomarker_names(biomarker_names)
+            print("\n" + format_ocr_results_for_display(result, normalized_existing))
             print()
 
-            # Write results back to the ODS file.
-            write_results_to_ods(args.ods, result, biomarker_names, has_assessment)
+            # Write results back to the ODS file. The next PDF has to match the
+            # columns and lab this one may have added.
+            biomarker_names = write_results_to_ods(
+                args.ods, result, biomarker_names, normalized_existing, has_assessment
+            )
+            lab_name = (result.get("lab_name") or "").strip()
+            if lab_name:
+                lab_names.add(lab_name)
 
             # Output the results (if requested)
             if args.output:
                 with open(args.output, "w") as f:
                     json.dump(result, f, indent=2)
                 print(f"OCR results also saved to {args.output}", file=sys.stderr)
-        except Exception as exc:
-            print(f"OCR failed: {exc}", file=sys.stderr)
-            raise SystemExit(1) from exc
+    except Exception as exc:
+        print(f"OCR failed: {exc}", file=sys.stderr)
+        raise SystemExit(1) from exc
+
+    if failed:
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
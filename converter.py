@@ -1,9 +1,7 @@
 #!/usr/bin/env -S uv run --script
 # /// script
-# requires-python = ">=3.8"
-# dependencies = [
-#     "odfpy",
-# ]
+# requires-python = ">=3.10"
+# dependencies = []
 # ///
 """
 CSV and ODS to JSON converter for blood test data.
@@ -13,36 +11,86 @@ Handles both standard format "Name {unit} [low-high]" and Greek CSV format.
 """
 
 import csv
+import functools
+import io
+import itertools
 import json
+import re
 import sys
+import zipfile
 from datetime import datetime
 from pathlib import Path
-
-from odf import text, teletype
-from odf.opendocument import load
-from odf.table import Table, TableRow, TableCell
-
-
+from typing import NamedTuple
+from xml.etree import ElementTree
+
+_TABLE_NAMESPACE = "urn:oasis:names:tc:opendocument:xmlns:table:1.0"
+_TEXT_NAMESPACE = "urn:oasis:names:tc:opendocument:xmlns:text:1.0"
+_TABLE_TAG = f"{{{_TABLE_NAMESPACE}}}table"
+_TABLE_ROW_TAG = f"{{{_TABLE_NAMESPACE}}}table-row"
+_TABLE_CELL_TAG = f"{{{_TABLE_NAMESPACE}}}table-cell"
+_COLUMNS_REPEATED_ATTRIBUTE = f"{{{_TABLE_NAMESPACE}}}number-columns-repeated"
+_PARAGRAPH_TAG = f"{{{_TEXT_NAMESPACE}}}p"
+_LINE_BREAK_TAG = f"{{{_TEXT_NAMESPACE}}}line-break"
+_TAB_TAG = f"{{{_TEXT_NAMESPACE}}}tab"
+_SPACE_TAG = f"{{{_TEXT_NAMESPACE}}}s"
+_SPACE_COUNT_ATTRIBUTE = f"{{{_TEXT_NAMESPACE}}}c"
+
+# Biomarker headers look like "Name {unit} [range]", where unit and range are optional.
+_HEADER_RE = re.compile(
+    r"^(?P<name>.+?)(?:\s*\{(?P<unit>[^}]*)\})?(?:\s*\[(?P<range>[^\]]*)\])?$"
+)
+_NUMBER_PATTERN = r"[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?"
+_NUMBER_RE = re.compile(_NUMBER_PATTERN)
+# Matches "low-high", where either bound may be missing (and may be negative).
+_RANGE_RE = re.compile(
+    rf"^\s*(?P<low>{_NUMBER_PATTERN})?\s*-\s*(?P<high>{_NUMBER_PATTERN})?\s*$"
+)
+
+# Biomarker values that mean the test didn't include the biomarker.
+_EMPTY_VALUES = frozenset(("", "."))
+
+# Date formats parse_date tries, in order.
+_DATE_FORMATS = (
+    "%Y-%m-%d",  # ISO format
+    "%Y/%m/%d",
+    "%d/%m/%Y",  # European format
+    "%m/%d/%Y",  # US format
+    "%d-%m-%Y",
+    "%m-%d-%Y",
+    "%Y%m%d",  # Compact format
+)
+
+
+@functools.cache
 def parse_date(date_str: str) -> str:
     """
     Parse a date string and return it in ISO-8601 format (YYYY-MM-DD).
 
     Tries multiple common date formats.
     Raises ValueError if the date cannot be parsed.
+    Results are cached, since many rows of a file usually share a date.
     """
-    date_formats = [
-        "%Y-%m-%d",  # ISO format
-        "%Y/%m/%d",
-        "%d/%m/%Y",  # European format
-        "%m/%d/%Y",  # US format
-        "%d-%m-%Y",
-        "%m-%d-%Y",
-        "%Y%m%d",  # Compact format
-    ]
-
     date_str = date_str.strip()
 
-    for fmt in date_formats:
+    # Most dates are already in ISO format, so read those directly instead of
+    # going through strptime. A valid one is returned as it is, since it doesn't
+    # need reformatting.
+    if (
+        len(date_str) == 10
+        and date_str.isascii()
+        and date_str[4] == "-"
+        and date_str[7] == "-"
+        and date_str[:4].isdigit()
+        and date_str[5:7].isdigit()
+        and date_str[8:].isdigit()
+    ):
+        try:
+            datetime(int(date_str[:4]), int(date_str[5:7]), int(date_str[8:]))
+            return date_str
+        except ValueError:
+            pass
+
+    for fmt in _DATE_FORMATS:
         try:
             dt = datetime.strptime(date_str, fmt)
             return dt.strftime("%Y-%m-%d")
@@ -52,175 +100,207 @@ def parse_date(date_str: str) -> str:
     raise ValueError(f"Unable to parse date: '{date_str}'")
 
 
+def _element_text(element: ElementTree.Element) -> str:
+    """Return the text of an element, like odfpy's teletype.extractText does."""
+    parts = [element.text or ""]
+    for child in element:
+        if child.tag == _LINE_BREAK_TAG:
+            parts.append("\n")
+        elif child.tag == _TAB_TAG:
+            parts.append("\t")
+        elif child.tag == _SPACE_TAG:
+            parts.append(" " * int(child.get(_SPACE_COUNT_ATTRIBUTE) or "1"))
+        else:
+            parts.append(_element_text(child))
+        parts.append(child.tail or "")
+    return "".join(parts)
+
+
 def read_ods_file(file_path: str) -> list:
     """
-    Read an ODS file and return data as a list of dictionaries.
+    Read an ODS file and return data as a list of rows.
+
+    Each row is a list of cell values, and the first row holds the column headers.
+    Empty rows are skipped.
 
-    Each dictionary represents a row with column headers as keys.
+    The rows of the first table are streamed from content.xml, and each row is
+    dropped once it has been read, instead of loading the whole document.
     """
-    doc = load(file_path)
-    tables = doc.getElementsByType(Table)
+    data: list = []
+    table_depth = 0
+    tables_seen = 0
+    rows_seen = 0
+
+    with zipfile.ZipFile(file_path) as archive, archive.open("content.xml") as content:
+        for event, element in ElementTree.iterparse(content, events=("start", "end")):
+            # Only read the rows of the first table.
+            if element.tag == _TABLE_TAG:
+                if event == "start":
+                    table_depth += 1
+                    tables_seen += 1
+                    continue
+                table_depth -= 1
+                if table_depth == 0:
+                    break
+                continue
+            if event == "start" or element.tag != _TABLE_ROW_TAG or not table_depth:
+                continue
 
-    if not tables:
+            cells = list(element.iter(_TABLE_CELL_TAG))
+            row_data: list = []
+
+            for cell in cells:
+                # Handle repeated cells.
+                repeat_attribute = cell.get(_COLUMNS_REPEATED_ATTRIBUTE)
+                repeat_count = int(repeat_attribute) if repeat_attribute else 1
+
+                # Get cell value by joining the text of all its paragraphs.
+                cell_value = "\n".join(
+                    _element_text(paragraph) for paragraph in cell.iter(_PARAGRAPH_TAG)
+                )
+
+                # Spreadsheets pad rows with empty cells repeated up to their last
+                # column. Data rows only need empty cells up to the width of the
+                # headers, since missing values are treated as empty strings, and
+                # the empty cells at the end of the header name no columns.
+                if not cell_value:
+                    if rows_seen:
+                        repeat_count = min(
+                            repeat_count, max(len(data[0]) - len(row_data), 0)
+                        )
+                    elif cell is cells[-1]:
+                        repeat_count = 1
+
+                # Add value(s) to row data.
+                row_data.extend(itertools.repeat(cell_value, repeat_count))
+
+            # First row contains headers, and empty rows below it are skipped.
+            if not rows_seen or any(val.strip() for val in row_data):
+                data.append(row_data)
+            rows_seen += 1
+
+            # Rows that have been read aren't needed anymore.
+            element.clear()
+
+    if not tables_seen:
         raise ValueError("No tables found in ODS file")
 
-    # Use the first table.
-    table = tables[0]
-    rows = table.getElementsByType(TableRow)
-
-    if not rows:
+    if not rows_seen:
         raise ValueError("No rows found in ODS table")
 
-    data = []
-    headers = []
-
-    for row_idx, row in enumerate(rows):
-        cells = row.getElementsByType(TableCell)
-        row_data = []
-
-        for cell in cells:
-            # Handle repeated cells.
-            repeat_count = int(cell.getAttribute("numbercolumnsrepeated") or 1)
+    return data
 
-            # Get cell value.
-            cell_value = ""
-            paragraphs = cell.getElementsByType(text.P)
-            if paragraphs:
-                # Join all text content from all paragraphs.
-                cell_value = "\n".join(teletype.extractText(p) for p in paragraphs)
 
-            # Add value(s) to row data.
-            for _ in range(repeat_count):
-                row_data.append(cell_value)
+class BiomarkerInfo(NamedTuple):
+    """The name, unit and reference range parsed from a biomarker header."""
 
-        # First row contains headers.
-        if row_idx == 0:
-            headers = row_data
-        else:
-            # Skip empty rows.
-            if any(val.strip() for val in row_data):
-                # Create dictionary for this row.
-                row_dict = {}
-                for col_idx, header in enumerate(headers):
-                    if col_idx < len(row_data):
-                        row_dict[header] = row_data[col_idx]
-                    else:
-                        row_dict[header] = ""
-                data.append(row_dict)
+    name: str
+    unit: str | None
+    low: float | None
+    high: float | None
 
-    return data
 
-
-def parse_biomarker_header(header: str) -> dict:
+def parse_biomarker_header(header: str) -> BiomarkerInfo:
     """
     Parse a biomarker header in format: Name {unit} [low-high]
 
-    Returns a dict with name, unit, low, and high values.
+    Returns a BiomarkerInfo with name, unit, low, and high values.
     Unit is optional (returns None if not present).
     Range is optional (returns None for both if not present).
     """
-    import re
-
-    # Pattern to match: Name {unit} [range] where unit and range are optional.
-    # First try with both unit and range.
-    pattern_full = r"^(.+?)\s*\{([^}]*)\}\s*\[([^\]]*)\]$"
-    match = re.match(pattern_full, header.strip())
+    header = header.strip()
 
+    # Both the unit and the range are optional, so only an empty header (or one
+    # with a line break in the name) won't match.
+    match = _HEADER_RE.match(header)
     if match:
-        name = match.group(1).strip()
-        unit = match.group(2).strip() if match.group(2) else None
-        range_str = match.group(3).strip()
+        name = match["name"].strip()
+        unit = match["unit"].strip() if match["unit"] else None
+        range_str = (match["range"] or "").strip()
     else:
-        # Try with just unit, no range.
-        pattern_unit = r"^(.+?)\s*\{([^}]*)\}$"
-        match = re.match(pattern_unit, header.strip())
-
-        if match:
-            name = match.group(1).strip()
-            unit = match.group(2).strip() if match.group(2) else None
-            range_str = ""
-        else:
-            # Try with just range, no unit.
-            pattern_range = r"^(.+?)\s*\[([^\]]*)\]$"
-            match = re.match(pattern_range, header.strip())
-
-            if match:
-                name = match.group(1).strip()
-                unit = None
-                range_str = match.group(2).strip()
-            else:
-                # No unit or range, just the name.
-                name = header.strip()
-                unit = None
-                range_str = ""
+        name = header
+        unit = None
+        range_str = ""
 
     # Parse the range.
     low = None
     high = None
-    if range_str:
-        if "-" in range_str:
-            parts = range_str.split("-", 1)
-            if parts[0].strip():
-                try:
-                    low = float(parts[0].strip())
-                except ValueError:
-                    pass
-            if parts[1].strip():
-                try:
-                    high = float(parts[1].strip())
-                except ValueError:
-                    pass
-        else:
-            # Single value could be either low or high, we'll treat as high for now.
-            try:
-                high = float(range_str.strip())
-            except ValueError:
-                pass
-
-    return {"name": name, "unit": unit, "low": low, "high": high}
-
-
-def convert_data_to_json(data: list, output_path: str = "data.json") -> None:
+    range_match = _RANGE_RE.match(range_str)
+    if range_match:
+        if range_match["low"]:
+            low = float(range_match["low"])
+        if range_match["high"]:
+            high = float(range_match["high"])
+    elif _NUMBER_RE.fullmatch(range_str):
+        # Single value could be either low or high, we'll treat as high for now.
+        high = float(range_str)
+
+    return BiomarkerInfo(name, unit, low, high)
+
+
+def convert_data_to_json(
+    data: list, output_path: str = "data.json", compact: bool = False
+) -> None:
     """
     Convert blood test data to JSON format.
 
-    Data is a list of dictionaries where each dict represents a row.
+    The JSON is indented for reading, unless compact is set. Compact JSON is
+    smaller for the viewer to load, and is encoded in one go with json.dumps,
+    which uses json's C encoder, while json.dump always uses the Python one.
+
+    Data is a list of rows, each of them a list of cell values, and the first
+    row holds the column headers.
     The data must have columns for Date and Lab, followed by biomarker columns.
     """
     tests = []
     categories = {}
 
-    if not data:
+    if len(data) < 2:
         raise ValueError("No data to convert")
 
-    # Get headers from first row.
-    headers = list(data[0].keys())
+    # Get headers from first row. Like the keys of a dictionary, a header that
+    # appears twice refers to the last of its columns.
+    headers = data[0]
+    column_indices = {field: index for index, field in enumerate(headers)}
+    data = data[1:]
 
     # Find Date and Lab columns (case-insensitive).
-    date_col = None
-    lab_col = None
-    assessment_col = None
-    biomarker_columns = {}  # Map column name to parsed info.
+    date_index = None
+    lab_index = None
+    assessment_index = None
+    # Index and biomarker entry of each biomarker column, without the value.
+    biomarker_columns = []
 
-    for field in headers:
+    for field, index in column_indices.items():
         field_lower = field.lower().strip()
         if "date" in field_lower:
-            date_col = field
+            date_index = index
         elif "lab" in field_lower:
-            lab_col = field
+            lab_index = index
         elif "assessment" in field_lower:
-            assessment_col = field
+            assessment_index = index
         else:
             # Parse biomarker header.
-            parsed = parse_biomarker_header(field)
-            if parsed["name"]:  # Valid biomarker.
-                biomarker_columns[field] = parsed
-
-    if not date_col:
+            info = parse_biomarker_header(field)
+            if info.name:  # Valid biomarker.
+                biomarker_columns.append(
+                    (
+                        index,
+                        {
+                            "name": info.name,
+                            "value": None,
+                            "unit": info.unit,
+                            "low": info.low,
+                            "high": info.high,
+                        },
+                    )
+                )
+
+    if date_index is None:
         print("Error: No 'Date' column found in data", file=sys.stderr)
         sys.exit(1)
 
-    if not lab_col:
+    if lab_index is None:
         print("Error: No 'Lab' column found in data", file=sys.stderr)
         sys.exit(1)
 
@@ -228,81 +308,77 @@ def convert_data_to_json(data: list, output_path: str = "data.json") -> None:
         print("Error: No valid biomarker columns found in data", file=sys.stderr)
         sys.exit(1)
 
-    # Find where categories section starts.
+    # Process each test data row, stopping at the categories section if found.
     categories_start_index = None
-    for idx, row in enumerate(data):
-        # Check all cells in the row for "Categories".
-        for value in row.values():
-            if value and "Categories" in str(value):
-                categories_start_index = idx + 1  # Start reading from next row.
-                break
-        if categories_start_index is not None:
-            break
-
-    # Process test data rows (stop at categories section if found).
-    test_data = data[: categories_start_index - 1] if categories_start_index else data
-
-    # Process each row.
     for row_num, row in enumerate(
-        test_data, start=2
+        data, start=2
     ):  # Start at 2 because row 1 is headers.
-        # Skip rows with empty date.
-        if not row.get(date_col, "").strip():
+        # The categories section starts after the first row with a cell that
+        # mentions "Categories", so look for it in the same pass.
+        if any("Categories" in value for value in row):
+            categories_start_index = row_num - 1  # Start reading from next row.
+            break
+
+        # Skip rows with empty date, before doing any other work on them. Rows
+        # that are shorter than the headers can be missing the date cell.
+        date_str = row[date_index] if date_index < len(row) else ""
+        if date_str:
+            date_str = date_str.strip()
+        if not date_str:
             continue
 
+        # Fill in the missing cells of rows that are shorter than the headers.
+        if len(row) < len(headers):
+            row = row + [""] * (len(headers) - len(row))
+
         # Check for required fields.
-        if not row.get(lab_col) or not row[lab_col].strip():
+        lab_name = row[lab_index].strip()
+        if not lab_name:
             print(f"Error: Missing lab name in row {row_num}", file=sys.stderr)
             sys.exit(1)
 
         # Parse the date.
         try:
-            date_iso = parse_date(row[date_col])
+            date_iso = parse_date(date_str)
         except ValueError as e:
             print(f"Error in row {row_num}: {e}", file=sys.stderr)
             sys.exit(1)
 
         # Process biomarkers for this test.
         biomarkers = []
-        for col, info in biomarker_columns.items():
-            value = row.get(col, "").strip()
+        for index, template in biomarker_columns:
+            value = row[index].strip()
 
             # Skip empty values (they may be legitimately missing for some tests).
-            if value == "" or value == ".":
+            if value in _EMPTY_VALUES:
                 continue
 
-            # Add biomarker with parsed info.
-            biomarkers.append(
-                {
-                    "name": info["name"],
-                    "value": value,
-                    "unit": info.get("unit"),
-                    "low": info.get("low"),
-                    "high": info.get("high"),
-                }
-            )
+            # Add biomarker with parsed info, copying the column's entry instead of
+            # building every key again.
+            biomarker = template.copy()
+            biomarker["value"] = value
+            biomarkers.append(biomarker)
 
         if biomarkers:  # Only add test if it has biomarkers.
             test_item = {
                 "date": date_iso,
-                "labName": row[lab_col].strip(),
+                "labName": lab_name,
                 "biomarkers": biomarkers,
             }
 
             # Add assessment if available.
-            if assessment_col and row.get(assessment_col, "").strip():
-                test_item["assessment"] = row[assessment_col].strip()
+            if assessment_index is not None:
+                assessment = row[assessment_index].strip()
+                if assessment:
+                    test_item["assessment"] = assessment
 
             tests.append(test_item)
 
     # Process categories section if found.
     if categories_start_index is not None and categories_start_index < len(data):
         for row in data[categories_start_index:]:
-            # Get all values from the row.
-            row_values = list(row.values())
-
             # Filter out empty values.
-            non_empty_values = [v.strip() for v in row_values if v and v.strip()]
+            non_empty_values = [v for v in map(str.strip, row) if v]
 
             if (
                 len(non_empty_values) >= 2
@@ -320,16 +396,26 @@ def convert_data_to_json(data: list, output_path: str = "data.json") -> None:
 
     # Write to output file
     with open(output_path, "w", encoding="utf-8") as jsonfile:
-        json.dump(output_data, jsonfile, indent=2, ensure_ascii=False)
+        if compact:
+            jsonfile.write(
+                json.dumps(output_data, separators=(",", ":"), ensure_ascii=False)
+            )
+        else:
+            json.dump(output_data, jsonfile, indent=2, ensure_ascii=False)
 
     print(f"Successfully converted {len(tests)} tests to {output_path}")
 
 
 def main():
     """Main entry point for the converter."""
-    if len(sys.argv) < 2:
+    args = sys.argv[1:]
+    compact = "--compact" in args
+    if compact:
+        args.remove("--compact")
+
+    if not args:
         print(
-            "Usage: python converter.py <input.csv|input.ods> [output.json]",
+            "Usage: python converter.py [--compact] <input.csv|input.ods> [output.json]",
             file=sys.stderr,
         )
         print(
@@ -340,10 +426,14 @@ def main():
             "       If output path is not specified, defaults to 'data.json'",
             file=sys.stderr,
         )
+        print(
+            "       --compact writes the JSON without indentation",
+            file=sys.stderr,
+        )
         sys.exit(1)
 
-    input_path = sys.argv[1]
-    output_path = sys.argv[2] if len(sys.argv) > 2 else "data.json"
+    input_path = args[0]
+    output_path = args[1] if len(args) > 1 else "data.json"
 
     if not Path(input_path).exists():
         print(f"Error: File '{input_path}' not found", file=sys.stderr)
@@ -357,10 +447,14 @@ def main():
             # Read ODS file.
             data = read_ods_file(input_path)
         elif file_extension == ".csv":
-            # Read CSV file.
-            with open(input_path, "r", encoding="utf-8") as csvfile:
-                reader = csv.DictReader(csvfile)
-                data = list(reader)
+            # Read CSV file. It's decoded in one go rather than line by line, and
+            # newline=None translates line endings like a text mode file would.
+            with open(input_path, "rb") as csvfile:
+                csv_text = csvfile.read().decode("utf-8")
+            # Skip blank lines, which csv.reader returns as empty rows.
+            data = [
+                row for row in csv.reader(io.StringIO(csv_text, newline=None)) if row
+            ]
         else:
             print(
                 f"Error: Unsupported file type '{file_extension}'. Use CSV or ODS.",
@@ -369,7 +463,7 @@ def main():
             sys.exit(1)
 
         # Convert to JSON.
-        convert_data_to_json(data, output_path)
+        convert_data_to_json(data, output_path, compact)
         print(f"Successfully converted {Path(input_path).name} to {output_path}")
 
     except Exception as e: